@@ -27,6 +27,11 @@ import plotly.express as px
 import numpy as np
 import matplotlib.pyplot as plt
 import sklearn as sk
+import nyc_rideshare as nyc
+
+# copy-on-write, so nyc.dataset() can share each data frame between cells (always on from pandas 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 
 # %% [markdown]
 # ## Background / Motivation
@@ -64,12 +69,26 @@ import sklearn as sk
 
 # %% [markdown]
 # ## Data quality check / cleaning / preparation 
+#
+# *(NOTE: the loading, cleaning and counting steps below are defined as named stages in nyc_rideshare.py, each listing the files and earlier stages it uses. A stage's result is saved in cache/stages and only recomputed when its code or inputs change, so editing one step does not re-run everything above it, and a single analysis can be run on its own with `python nyc_rideshare.py <analysis number>`.)*
 
 # %% [markdown]
 # ##### TLC Aggregate Report Data
 
 # %%
-TLC_aggregate_report = pd.read_csv('FHV_Base_Aggregate_Report_20240926.csv')
+# parse all of the source files at once, one process per file, into the cache the stages load from
+nyc.fill_cache()
+
+# %%
+nyc.stage_status()
+
+# %% [markdown]
+# *(NOTE: `nyc.dataset()` hands out copy-on-write handles of each stage's data frame instead of separate copies: every handle shares the same memory until a cell changes one of its columns, and only that column is copied. The cells below therefore no longer `.copy()` a data frame before modifying it, and at the end of an analysis the frames it no longer needs are deleted and released. This saves little on its own: the peak memory of the report went from 390 to 384 MB with it. The real savings come from the cached stages and the loaders that read every file with explicit types.)*
+
+# %%
+# every CSV is read with explicit dtypes (see nyc_rideshare.py), parsed once and cached as a
+# Feather file in cache/, which later runs memory-map
+TLC_aggregate_report = nyc.dataset('tlc_snapshot')
 print('Continuous variables:')
 TLC_aggregate_report[['Total Dispatched Trips', 'Total Dispatched Shared Trips', 'Unique Dispatched Vehicles']].describe()
 
@@ -89,68 +108,49 @@ print('Number of unique values for month:', len(TLC_aggregate_report.Month.uniqu
 # In the TLC aggregate report data, there are no abnormalities in any of the columns that require filtering, imputation, cleaning, etc. While the column 'DBA' does have about 42,000 missing values, this is acceptable. 'DBA' stands for 'Doing Business As'. When the values of 'Base Name' and 'DBA' are identical, the 'DBA' is left as NULL.
 # No other data preparation was required for this dataset.
 
+# %% [markdown]
+# This snapshot of the report (2015 to September 2024) and the older one used in Analysis 2 (2015 to 2022) overlap, so rather than reading both in full and comparing them by eye, the records of the two are matched by base, year and month, and sorted into records that are unchanged, revised, added in the newer snapshot, or missing from it:
+
+# %%
+tlc_diff = nyc.dataset('tlc_diff')
+tlc_diff['summary']
+
+# %%
+tlc_diff['revised'].head()
+
 # %% [markdown]
 # ##### Kaggle Dataset
 # This dataset was originally split into multiple datasets. There were six separate sets for the 2014 data, and one for the 2015 data. Firstly, some data preparation had to be done in order to combine all of these datasets into one, which consisted of importing the data and concatenating all of the data sets into one dataframe:
 
 # %%
 #importing and concatonating all data from 2014 together
-one = pd.read_csv('uber-raw-data-apr14.csv')
-two = pd.read_csv('uber-raw-data-aug14.csv')
-three = pd.read_csv('uber-raw-data-jul14.csv')
-four = pd.read_csv('uber-raw-data-jun14.csv')
-five = pd.read_csv('uber-raw-data-may14.csv')
-six = pd.read_csv('uber-raw-data-sep14.csv')
-frames = [one, two, three, four, five, six]
-kaggle2014 = pd.concat(frames)
-uber_data2014 = kaggle2014.copy()
-kaggle2014 = kaggle2014.reset_index()
+kaggle2014 = nyc.dataset('uber_2014')
 
 #adding 2015 data
-kaggle2015 = pd.read_csv('uber-raw-data-janjune-15.csv')
-kaggle_2014_to_2015 = pd.concat([kaggle2014, kaggle2015], axis=0)
-kaggle_2014_to_2015.reset_index()
+kaggle2015 = nyc.dataset('uber_2015')
 
 # %% [markdown]
 # After concatenating the datasets, the columns which contained the pickup times for each data group (2014 and 2015) were separated. These two columns were combined into one Series, and then added to the dataframe as 'Pickup Time'. Finally, 'Pickup Time' was converted to the datetime datatype, which would be necessary for the analysis in the future. A similar process was done for 'Dispatch Base', except that for this column, it was left as a string.
 
 # %%
-#cleaning pickup time columns
-pickup_time_2014 = kaggle2014['Date/Time']
-pickup_time_2015 = kaggle2015['Pickup_date']
-
-pickup_times = pd.concat([pickup_time_2014, pickup_time_2015], axis=0)
-pickup_times = pickup_times.reset_index()
-pickup_times = pickup_times.drop('index', axis = 1)
-pickup_times = pickup_times.rename(columns={0: "Pickup Time"})
-
-#adding this combined pickup time to kaggle2014-2015, then converting to datetime
-kaggle_2014_to_2015['Complete Pickup Time'] = pickup_times
-kaggle_2014_to_2015['Complete Pickup Time'] = pd.to_datetime(kaggle_2014_to_2015['Complete Pickup Time'], format='mixed')
-
-#cleaning base columns
-base_2014 = kaggle2014['Base']
-base_2015 = kaggle2015['Dispatching_base_num']
-
-bases = pd.concat([base_2014, base_2015], axis=0)
-bases = bases.reset_index()
-bases = bases.drop('index', axis = 1)
-bases = bases.rename(columns={0: "Base"})
-
-#adding combined dispatch to kaggle2014-2015
-kaggle_2014_to_2015['Dispatch Base'] = bases
+#concatenating 2014 and 2015, converting each year's pickup times to datetime with its own
+#format (2014 is 4/1/2014 0:11:00, 2015 is 2015-01-01 00:11:00), combining the dispatch
+#bases, labeling each base's company and dropping the original columns (see the 'kaggle' stage)
+kaggle_2014_to_2015 = nyc.dataset('kaggle')
 
 # %% [markdown]
 # Lastly, the 'Index', 'Date/Time', 'Base', 'Dispatching_base_num', 'Pickup_date', and 'Affiliated_base_num' columns were dropped from the DataFrame.  In the final dataset, the first portion of the observations correspond to the 2014 data, while the second portion corresponds to the 2015 data.
 
 # %%
-columns_drop=['index', 'Date/Time', 'Base', 'Dispatching_base_num', 'Pickup_date', 'Affiliated_base_num']
-kaggle_2014_to_2015 = kaggle_2014_to_2015.drop(columns=columns_drop)
 kaggle_2014_to_2015
 
 # %%
 kaggle_2014_to_2015.describe()
 
+# %%
+#trips per company, from each trip's dispatch base (all of the Kaggle bases dispatch for Uber)
+kaggle_2014_to_2015['Company'].value_counts()
+
 # %%
 print('Missing values for each column')
 kaggle_2014_to_2015.isnull().sum()
@@ -165,47 +165,37 @@ print('Number of unique values for Dispatch Base:', len(kaggle_2014_to_2015['Dis
 # ##### NYPD Complaint Data Historic
 
 # %%
-crime_data = pd.read_csv('NYPD_complaint_data.csv')
-#dropping unneccesary columns
-crime_data = crime_data.drop(columns=['Unnamed: 0', 'complaint_year', 'complaint_month'])
+#unneccesary columns (the index and the pre-computed year and month) are not loaded, the rest are
+#renamed to nyc.CRIME_COLUMNS, and only complaints from 2014 and 2015 with both coordinates are
+#kept while the file is read (see the 'crime' stage)
+crime_data = nyc.dataset('crime')
 
 # %% [markdown]
 # To clean the data, I started by renaming the columns so that it was easier for me to identify what information each column contained.
-
-# %%
-new_col_names = ['complaint_date', 'complaint_time', 'gen_description', 'pd_description', 'level_of_offense', 'borough', 'location_type', 'Latitude', 'Longitude']
-crime_data.columns = new_col_names
-
-# %% [markdown]
+#
 # After that, I converted the date of the reported crime to datetime so that I could sort out the reported crimes from 2014 and 2015. I also used this to get the month and year of each reported crime so that I would be able to sift through the data using the conditions month and year.
-
-# %%
-crime_data['complaint_date'] = pd.to_datetime(crime_data['complaint_date'], errors='coerce')
-crime_data['complaint_year'] = crime_data['complaint_date'].dt.strftime('%Y')
-crime_data['complaint_month'] = crime_data['complaint_date'].dt.strftime('%m')
-
-# %% [markdown]
+#
 # I also narrowed it down to only include data from 2014 and 2015 - the time period our group decided to analyze.
-
-# %%
-data_14_15 = crime_data[(crime_data['complaint_year']=='2014')|(crime_data['complaint_year']=='2015')]
-
-# %% [markdown]
+#
 # I needed the longitude and latitude because I was plotting points on a map based on those coordinates. I decided to drop all of the rows that had no data for longitude or latitude. Before making this choice, I was concerned about affecting the conclusion because there were 26 rows with missing data. However, the data with missing coordinate values only made up about 0.002% of the total data which has 971,051 observations. I also did not want to impute any coordinate data because there were still plenty of data points to demonstrate the trend, and I could not determine a way to impute the data that would make sense.
+#
+# *(NOTE: the full history has over seven million rows, so all four of these steps now happen while the file is read in chunks: each chunk is renamed, its dates are parsed, and only the 2014 and 2015 rows with coordinates are kept. The year and month are stored as integers.)*
 
-# %%
-data_14_15.shape
+# %% [markdown]
+# Memory used by the typed data frames compared to reading the same files with pandas' default types:
 
 # %%
-print('Number of missing values by column:')
-data_14_15.isna().sum()
+nyc.memory_report({'FHV aggregate report': ('FHV_Base_Aggregate_Report_20240926.csv', TLC_aggregate_report),
+                   'Uber Apr-Sep 2014': ('uber-raw-data-apr14.csv', kaggle2014),
+                   'Uber Jan-Jun 2015': ('uber-raw-data-janjune-15.csv', kaggle2015),
+                   'NYPD complaints': ('NYPD_complaint_data.csv', crime_data)})
 
 # %%
-data_14_15 = data_14_15[~data_14_15.Longitude.isna()]
-data_14_15 = data_14_15[~data_14_15.Latitude.isna()]
+data_14_15 = nyc.dataset('crime')
+data_14_15.shape
 
 # %%
-crime_14_15 = data_14_15.copy()
+crime_14_15 = nyc.dataset('crime')
 
 # %% [markdown]
 # While there are still missing values, they do not impact the analysis.
@@ -225,7 +215,7 @@ data_14_15.describe()
 # ##### Borough Boundaries Geojson
 
 # %%
-boros = gpd.read_file('Borough_Boundaries.geojson')
+boros = nyc.dataset('boroughs')
 
 # %% [markdown]
 # This dataset was very easy to work with because there were only 5 total entries: one for each of the boroughs in New York City. The describe feature worked slightly differently on this dataset because it is a Geodataframe. I did not have to alter this dataset because it was very straightforward and contained all the data I needed.
@@ -241,14 +231,6 @@ boros.isna().sum()
 # ### Analysis 1
 # *By Jack McNally*
 
-# %%
-uber_apr=one.copy()
-uber_aug=two.copy()
-uber_jul=three.copy()
-uber_jun=four.copy()
-uber_may=five.copy()
-uber_sep=six.copy()
-
 # %% [markdown]
 # For my analysis, I analyzed the number of Ubers ordered in New York City broken down into each of the five boroughs (Manhattan, Bronx, Queens, Staten Island, Brooklyn). However, because the Uber data was structured differently for 2014 and 2015, my approach in categorizing Uber rides to boroughs was different for each dataset.
 # 
@@ -264,87 +246,21 @@ uber_sep=six.copy()
 # all_filenames = [i for i in glob.glob('*.{}'.format(extension))]
 # combined_uber=pd.concat([pd.read_csv(f) for f in all_filenames])
 # combined_uber.to_csv("combined_csv.csv", index=False, encoding = 'utf-8-sig')
-combined_uber = uber_data2014.copy()
+combined_uber = nyc.dataset('uber_2014')
 combined_uber
 
+# %% [markdown]
+# *(NOTE: the rectangles left gaps along the shorelines and overlapped near the borders, so a pickup near the Harlem River or the Brooklyn/Queens line could be counted in two boroughs or in none, and each borough function filtered the whole 2014 data frame again. The rectangles have since been replaced by the borough outlines in Borough_Boundaries.geojson: every pickup is labeled with the borough polygon it falls in, in a single pass, and pickups outside all five boroughs (e.g. New Jersey, Westchester and Nassau County) are left unlabeled.)*
+
 # %%
 %matplotlib inline
-data = pd.DataFrame()
-
-#(down, up) (left, right)
-
-def manhattan(data):
-    data = data[(data['Lat'].between(40.701426, 40.810606) & data['Lon'].between(-74.019561, -73.975601)) |
-                #square one
-                (data['Lat'].between(40.775555, 40.878306) & data['Lon'].between(-73.975601, -73.930901)) |
-                #square 2
-                (data['Lat'].between(40.756607, 40.775555) & data['Lon'].between(-73.975601, -73.945157)) |
-                #square 3
-                (data['Lat'].between(40.734383, 40.756607) & data['Lon'].between(-73.975601, -73.962062))
-                #square 4 
-               ]
-    return data
-
-def bronx(data):
-    data = data[(data['Lat'].between(40.802951, 40.912623) & data['Lon'].between(-73.910130,-73.764666)) |
-                #square one
-                (data['Lat'].between(40.802951, 40.859068) & data['Lon'].between(-73.930324,-73.910130))
-                #square two 
-            ]
-    return data
-
-def queens(data):
-    data = data[(data['Lat'].between(40.621930,40.800482) & data['Lon'].between(-73.868944,-73.700464))|
-                #square one
-                (data['Lat'].between(40.683894,40.790877) & data['Lon'].between(-73.913135,-73.868944))|
-                #square two
-                (data['Lat'].between(40.729766,40.781454) & data['Lon'].between(-73.934580,-73.913135))
-                #square three
-               ]
-    return data
-
-def brooklyn(data):
-    data = data[(data['Lat'].between(40.572077,40.695474) & data['Lon'].between(-74.042047,-73.858306))|
-                #square one
-                (data['Lat'].between(40.695474,40.708849) & data['Lon'].between(-74.000258,-73.912798))|
-                #square two
-                (data['Lat'].between(40.708849,40.734609) & data['Lon'].between(-73.970169,-73.922498))
-                #square three
-               ]
-    return data
-
-def staten_island(data):
-    data = data[(data['Lat'].between(40.494395,40.648781) & data['Lon'].between(-74.205546,-74.052424))|
-                #square one
-                (data['Lat'].between(40.494395,40.571633) & data['Lon'].between(-74.256701,-74.205546))
-                #square two
-                ]
-    return data
-stat = staten_island(combined_uber)
-bron = bronx(combined_uber)
-manh = manhattan(combined_uber)
-quee = queens(combined_uber)
-brook = brooklyn(combined_uber)
-
-# %%
-stat
-
-# %%
-bron
-
-# %%
-manh
-
-# %%
-quee
-
-# %%
-brook
-
-# %%
-borough_data = pd.DataFrame()
-borough_data['Borough'] = "Staten Island", "Bronx", "Manhattan", "Queens", "Brooklyn"
-borough_data['Uber Rides'] = len(stat), len(bron), len(manh), len(quee), len(brook)
+### Label every 2014 pickup with its borough (see the 'uber_2014_boroughs' stage)
+combined_uber = combined_uber.assign(Borough=nyc.dataset('uber_2014_boroughs'))
+combined_uber['Borough'].value_counts(dropna=False)
+
+# %%
+borough_counts = combined_uber['Borough'].value_counts()
+borough_data = nyc.borough_table(borough_counts)
 borough_data['Uber Rides'].sum()
 
 # %% [markdown]
@@ -354,11 +270,11 @@ borough_data['Uber Rides'].sum()
 # For the 2015 Uber data, each ride had a specific taxi zone location number. Initially I was unsure how I could link the taxi zone location number to NYC borough. However, after some research, I found that the taxi zone location numbers were standardized for rideshare apps and taxis across the city. I found a dataset linking each location number to other information including NYC borough, and then merged the 2015 Uber data and the taxi zone location data and added the number of rides for each borough [1].
 
 # %%
-uber_jan_jun_15 = kaggle2015.copy()
+uber_jan_jun_15 = nyc.dataset('uber_2015')
 uber_jan_jun_15.sort_values('locationID').head()
 
 # %%
-taxi_zone= pd.read_csv('taxi_zone_lookup.csv')
+taxi_zone= nyc.load_taxi_zones('taxi_zone_lookup.csv')
 taxi_zone.sort_values('LocationID').head()
 
 # %%
@@ -373,16 +289,8 @@ del uber_jan_jun_15['locationID']
 uber_jan_jun_15['Borough'].value_counts()
 
 # %%
-manhattan_15= uber_jan_jun_15[uber_jan_jun_15['Borough']=='Manhattan']
-brooklyn_15= uber_jan_jun_15[uber_jan_jun_15['Borough']=='Brooklyn']
-queens_15= uber_jan_jun_15[uber_jan_jun_15['Borough']=='Queens']
-bronx_15= uber_jan_jun_15[uber_jan_jun_15['Borough']=='Bronx']
-staten_island_15= uber_jan_jun_15[uber_jan_jun_15['Borough']=='Staten Island']
-
-# %%
-borough_data_15= pd.DataFrame()
-borough_data_15['Borough'] = "Staten Island", "Bronx", "Manhattan", "Queens", "Brooklyn"
-borough_data_15['Uber Rides'] = len(staten_island_15), len(bronx_15), len(manhattan_15), len(queens_15), len(brooklyn_15)
+borough_counts_15 = uber_jan_jun_15['Borough'].value_counts()
+borough_data_15 = nyc.borough_table(borough_counts_15)
 
 # %%
 borough_data_15
@@ -404,6 +312,12 @@ borough_data_15['Uber Rides'].sum()
 # 
 # As mentioned earlier, the only code I used in my analysis outside of the original Uber datasets was the taxi zone dataset I used for the 2015 Uber ride information [1]. The changes I made to this code involved merging it to the 2015 data and removing all columns besides the borough classification.
 
+# %%
+# the 2014 and 2015 pickups are not used again until Analysis 4, which reloads the ones it needs
+del combined_uber, uber_jan_jun_15, kaggle2014, kaggle2015
+nyc.release()
+nyc.live_datasets()
+
 # %% [markdown]
 # ### Analysis 2
 # *By Samuel Sword*
@@ -412,10 +326,13 @@ borough_data_15['Uber Rides'].sum()
 # For this part of the project, change in rideshare statistics over time was analyzed, using the Kaggle dataset consisting of rideshare statistics in New York City and the TLC aggregate data consisting of Vehicle For Hire (VFH) statistics. Ridesharing companies are included in this dataset. Firstly, the TLC aggregate data was analyzed in order to compare and contrast the rideshare industry with the traditional transportation industry (taxis, limos, etc). A boxplot based on the entire dataset was created in order to visualize the average number of dispatches per month, per year. It is worth noting that in this dataset, each observation corresponds to an entire month's worth of data for the company which the observation represents.
 
 # %%
-TLC_aggregate_report = pd.read_csv('FHV_Base_Aggregate_Report.csv')
+# the report's new months are added to the FHV store (see nyc_rideshare.py), and the plots below
+# read its per-year, per-company rollup of dispatched trips instead of re-aggregating the report
+TLC_aggregate_report = nyc.dataset('tlc_report')
+TLC_rollup = nyc.update_fhv_store(TLC_aggregate_report)
 
 # dispatched trips by year
-ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=TLC_aggregate_report)
+ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=nyc.fhv_yearly(TLC_rollup))
 ax.figure.set_figwidth(15)
 plt.xlabel('Year', fontsize=14);
 plt.ylabel('Avg dispatched trips per month', fontsize=14)
@@ -428,12 +345,9 @@ ax.set_title("Average Dispaches Per Year", fontsize = 20)
 
 # %%
 #removing top four rideshare
-TLC_no_rideshare = TLC_aggregate_report.loc[(TLC_aggregate_report['Base Name'] != 'UBER') &
-                                            (TLC_aggregate_report['Base Name'] != 'LYFT')&
-                                            (TLC_aggregate_report['Base Name'] != 'JUNO') &
-                                            (TLC_aggregate_report['Base Name'] != 'VIA')]
+TLC_no_rideshare = TLC_rollup.loc[TLC_rollup['Company'] == 'OTHER']
 
-ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=TLC_no_rideshare)
+ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=nyc.fhv_yearly(TLC_no_rideshare))
 ax.figure.set_figwidth(8)
 plt.xlabel('Year', fontsize=14);
 plt.ylabel('Avg dispatched trips (per month)', fontsize=14)
@@ -444,13 +358,10 @@ ax.set_title("Average non-Rideshare Dispaches Per Year", fontsize = 20)
 
 # %%
 #UBER LIFT JUNO AND VIA
-UBER_LIFT_JUNO_VIA = TLC_aggregate_report.loc[(TLC_aggregate_report['Base Name']=='UBER') | 
-                                              (TLC_aggregate_report['Base Name']=='LYFT') |
-                                              (TLC_aggregate_report['Base Name']=='JUNO') |
-                                              (TLC_aggregate_report['Base Name']=='VIA')]
+UBER_LIFT_JUNO_VIA = TLC_rollup.loc[TLC_rollup['Company'] != 'OTHER']
 
 # Dispatched trips by year
-ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=UBER_LIFT_JUNO_VIA)
+ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=nyc.fhv_yearly(UBER_LIFT_JUNO_VIA))
 ax.figure.set_figwidth(15)
 plt.xlabel('Year', fontsize=14);
 plt.ylabel('Avg dispatched trips per month', fontsize=14)
@@ -461,12 +372,11 @@ ax.set_title("Top 4 Rideshare Dispaches Per Year", fontsize = 20)
 
 # %%
 #getting all the VFH companies that aren't top four rideshare
-VFH_comparison = TLC_aggregate_report.copy()
-rideshare_companies_list = ['UBER', 'LYFT', 'JUNO', 'VIA']
-VFH_comparison = VFH_comparison.assign(Rideshare_Company = lambda x: x['Base Name'].isin(rideshare_companies_list))
+VFH_comparison = TLC_rollup
+VFH_comparison = VFH_comparison.assign(Rideshare_Company = lambda x: x['Company'] != 'OTHER')
 
 # pivoting tables
-rideshare_norideshare_comparison = VFH_comparison.pivot_table(index = 'Year', columns = 'Rideshare_Company',values = 'Total Dispatched Trips')
+rideshare_norideshare_comparison = nyc.fhv_yearly(VFH_comparison, by='Rideshare_Company').pivot(index = 'Year', columns = 'Rideshare_Company',values = 'Total Dispatched Trips')
 
 ax = rideshare_norideshare_comparison.plot(ylabel = 'Total Dispatched Trips',figsize = (10,6),marker='o')
 ax.yaxis.set_major_formatter('{x:,.0f}')
@@ -481,10 +391,10 @@ ax.set_title("Rideshare vs. Non-Rideshare Companies", fontsize = 20)
 
 # %%
 # Just UBER and LIFT data
-TLC_agg_UBER_and_LIFT = TLC_aggregate_report.loc[(TLC_aggregate_report['Base Name']=='UBER') | (TLC_aggregate_report['Base Name']=='LYFT')]
+TLC_agg_UBER_and_LIFT = TLC_rollup.loc[TLC_rollup['Company'].isin(['UBER', 'LYFT'])]
 
 # dispatched trips by year
-ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=TLC_agg_UBER_and_LIFT)
+ax = sns.barplot(x="Year", y = 'Total Dispatched Trips',  data=nyc.fhv_yearly(TLC_agg_UBER_and_LIFT))
 ax.figure.set_figwidth(8)
 plt.xlabel('Year', fontsize=14);
 plt.ylabel('Avg dispatched trips (per month)', fontsize=14)
@@ -494,7 +404,7 @@ ax.set_title("Average Uber/LYFT Dispaches Per Year", fontsize = 20)
 # Finally, the dataset consisting of the top four rideshare companies was reshaped by pivoting the table, which allowed for the visualization of each of the four’s dispatch trends over time:
 
 # %%
-top4_by_year = UBER_LIFT_JUNO_VIA.pivot_table(index = 'Year', columns = 'Base Name',values = 'Total Dispatched Trips')
+top4_by_year = nyc.fhv_yearly(UBER_LIFT_JUNO_VIA, by='Company').pivot(index = 'Year', columns = 'Company',values = 'Total Dispatched Trips').sort_index(axis=1)
 #lineplot
 ax = top4_by_year.plot(ylabel = 'Total Dispatched Trips',figsize = (10,6),marker='o')
 ax.yaxis.set_major_formatter('{x:,.0f}')
@@ -506,8 +416,12 @@ ax.set_title("Top Rideshare Companies by Year", fontsize = 20)
 # Following the analysis of the TLC aggregated dataset, an examination of the kaggle dataset consisting of Uber rides from 2014-2015 in NYC was conducted. This dataset included specific times of pickups for each dispatch, so the hope was to analyze rideshare statistics by time of day/night. The data from 2014 was broken into monthly sets, so first, those datasets were imported and concatenated together, then concatenated with the 2015 data to create a dataset with the entire time frame. The columns consisting of pickup times were combined and transformed into a datetime datatype, and from here a bar plot reflecting number of Ubers dispatched by hour was created:
 
 # %%
+#pickups and crime complaints counted by hour, day, month, year and borough in one pass, which
+#the time charts below take their counts from (see the 'time_cube' stage)
+time_cube = nyc.dataset('time_cube')
+
 #plotting average pickup time
-kaggle_2014_to_2015['Complete Pickup Time'].dt.hour.value_counts().sort_index().plot(kind = 'bar', rot=0, color='orange', figsize=(12,4))
+nyc.cube_counts(time_cube, 'hour', source='uber').plot(kind = 'bar', rot=0, color='orange', figsize=(12,4))
 plt.xlabel('Hour', fontsize=14)
 plt.ylabel('Number of Ubers called', fontsize=14)
 plt.title('Uber Dispatches by Hour', fontsize=18)
@@ -519,7 +433,7 @@ plt.title('Uber Dispatches by Hour', fontsize=18)
 
 # %%
 #plotting average pickups per day
-kaggle_2014_to_2015['Complete Pickup Time'].dt.day.value_counts().sort_index().plot(kind = 'bar', rot=0, color='orange')
+nyc.cube_counts(time_cube, 'day', source='uber').plot(kind = 'bar', rot=0, color='orange')
 plt.xlabel('Day', fontsize=14)
 plt.ylabel('Ubers called', fontsize=14)
 
@@ -527,10 +441,8 @@ plt.ylabel('Ubers called', fontsize=14)
 # Lastly, a pre-cleaned dataset consisting of crime complaint in New York City with the same timeline as the Kaggle dataset was imported, and a barplot visualizing crime complaints by hour was created:
 
 # %%
-crime_14_15['complaint_time'] = pd.to_datetime(crime_14_15['complaint_time'])
-
 #crime complaints by hour
-crime_14_15['complaint_time'].dt.hour.value_counts().sort_index().plot(kind = 'bar', rot=0, figsize=(15,5))
+nyc.cube_counts(time_cube, 'hour', source='crime').plot(kind = 'bar', rot=0, figsize=(15,5))
 plt.xlabel('Hour', fontsize=14)
 plt.ylabel('Complaints', fontsize=14)
 plt.title('Crime Complaints by Hour', fontsize=18)
@@ -539,11 +451,27 @@ plt.title('Crime Complaints by Hour', fontsize=18)
 # Here is the bar plot of Uber dispatches per hour for comparison:
 
 # %%
-kaggle_2014_to_2015['Complete Pickup Time'].dt.hour.value_counts().sort_index().plot(kind = 'bar', rot=0, color='orange', figsize=(12,4))
+nyc.cube_counts(time_cube, 'hour', source='uber').plot(kind = 'bar', rot=0, color='orange', figsize=(12,4))
 plt.xlabel('Hour', fontsize=14)
 plt.ylabel('Number of Ubers called', fontsize=14)
 plt.title('Uber Dispatches by Hour', fontsize=18)
 
+# %% [markdown]
+# *(NOTE: instead of comparing the two shapes by eye, the hourly Uber (and Lyft) pickups of every hour of 2014 were correlated with the hourly crime complaints shifted by up to a day either way, per borough and per 2 decimal cell. A positive peak lag means the complaints peak that many hours after the pickups:)*
+
+# %%
+lagged_correlations = nyc.dataset('lagged_correlations')
+lagged_correlations['peaks by borough']
+
+# %%
+lagged_correlations['uber by borough'].T.plot(figsize=(12,4))
+plt.xlabel('Lag (hours)', fontsize=14)
+plt.ylabel('Correlation', fontsize=14)
+plt.title('Uber Dispatches vs. Crime Complaints by Lag', fontsize=18)
+
+# %%
+lagged_correlations['peaks by cell'].groupby('source')['peak lag (h)'].describe()
+
 # %% [markdown]
 # Unsurprisingly, the two graphs have very similar shapes, and have peaks around 6 PM. This is to be expected, not because crime rates and and Uber dispatches are causally correlated, but because the frequency of both crime complaints and Uber dispatches are most likely correlated to times when the most human activity in New York City is occurring in general (this would likely be around evening time). Furthermore, as general human activity decreases into the late night/early morning hours, so do crime complaints and Uber dispatches.
 # 
@@ -558,43 +486,48 @@ plt.title('Uber Dispatches by Hour', fontsize=18)
 # %% [markdown]
 # I determined which boroughs had the highest reported crime densities in New York City, and I looked for changes in crime densities throughout 2014 and 2015. To clarify, "crime density is most simply described as the number of crime incidents within a certain area" [3]. I began by cleaning my data. The dataset I used was titled "NYPD Complaint Data Historic" which I downloaded from the City of New York data site. This dataset included over seven million entries and over 30 columns, though I only imported 9 of the columns to make it run more efficiently.
 # 
-# I wanted to create density heatmaps to see which boroughs had the highest reported crime densities and if there were any changes in the data over the period 2014 to 2015. I split the data into four parts: January through June of 2014, July through December of 2014, January through June of 2015, and July through December of 2015. I used a lambda function to turn the data in the complaint month column from datetime objects into integers so that I could sort the data by month more easily.
-
-# %%
-data_14_15['complaint_month'] = data_14_15['complaint_month'].apply(lambda x:int(x))
+# I wanted to create density heatmaps to see which boroughs had the highest reported crime densities and if there were any changes in the data over the period 2014 to 2015. I split the data into four parts: January through June of 2014, July through December of 2014, January through June of 2015, and July through December of 2015. The complaint month column is stored as an integer so that I could sort the data by month more easily.
 
 # %%
-data_2014_jantojune = data_14_15[(data_14_15['complaint_year']=='2014')&(data_14_15['complaint_month']<=6)]
-data_2014_julytodec = data_14_15[(data_14_15['complaint_year']=='2014')&(data_14_15['complaint_month']>=7)]
-data_2015_jantojune = data_14_15[(data_14_15['complaint_year']=='2015')&(data_14_15['complaint_month']<=6)]
-data_2015_julytodec = data_14_15[(data_14_15['complaint_year']=='2015')&(data_14_15['complaint_month']>=7)]
+data_2014_jantojune = data_14_15[(data_14_15['complaint_year']==2014)&(data_14_15['complaint_month']<=6)]
+data_2014_julytodec = data_14_15[(data_14_15['complaint_year']==2014)&(data_14_15['complaint_month']>=7)]
+data_2015_jantojune = data_14_15[(data_14_15['complaint_year']==2015)&(data_14_15['complaint_month']<=6)]
+data_2015_julytodec = data_14_15[(data_14_15['complaint_year']==2015)&(data_14_15['complaint_month']>=7)]
 
 # %% [markdown]
 # At this stage, I ran into a problem when creating the maps. There were so many data points across the maps that the Jupyter notebook crashed and returned a memory error each time I tried to run it. To fix this problem, I first tried to break the data up into smaller groups. This did not work because all of the maps were still trying to parse through a massive amount of data in the same notebook. To circumvent this issue, I saved the 4 groups of data to csv files so that I could create each of the maps in different Jupyter Notebooks. Then, I created a new Jupyter notebook for each of the 4 groups of data so that I could create a density map for each period of time.
 # 
-# *(NOTE: for the purpose of this report, I did not create separate csv files and Jupyter notebook files. All of the code for the maps is in a cell with "#|eval:false" to prevent it from running and crashing the notebook. I have attached a zip file on Canvas with the html files including the code and the interactive map images so that you can easily access them.)*
+# *(NOTE: for the purpose of this report, I did not create separate csv files and Jupyter notebook files. The map code used to sit in a cell with "#|eval:false" to keep it from crashing the notebook, with the html files of the maps attached on Canvas; it now runs as part of the report, as described in the note before the maps below.)*
 # 
 # To create these maps, I used a python graphing library called Plotly. I was looking for a way to efficiently plot using longitude and latitude, and I came across a Plotly article for making density heatmaps [4]. Using the longitudes and latitudes for each point in my dataset and the "density_mapbox" feature of Plotly, I created an interactive map with a zoom feature which allowed me to look closely at the different boroughs of New York City. My code was not too different from the sample code in the article because the purpose of my code and the code in the article were both to create a density heatmap using longitude and latitude. After looking at the Plotly documentation, I replaced the pieces of code with the data I needed, and I removed the parameter "z" because I did not need to weight any of my points. Overall, Plotly was a very handy tool for analyzing the data.
 # 
 # After that, I ran into some difficulty trying to plot outlines of the boroughs using Plotly. I came across the GeoPandas library which uses geojson files containing longitude and latitude to create map-like plots in matplotlib [5]. I created a GeoDataframe that contained Multipolygon objects that GeoPandas uses to create borders based on coordinates. Next I had to figure out how to transpose the borough borders onto the Ploty density heatmap. After trying many different ways to plot the points, I came across code in a Stack Overflow forum that used the parameter "mapbox" within the "update_layout" attribute of the figure [6]. After getting rid of the parameters that I did not need and adjusting the other to fit my data, I was able to transpose the data from the Geopandas object onto the maps to create the borough limits.
 
 # %%
-boros = gpd.read_file('Borough_Boundaries.geojson')
+boros = nyc.dataset('boroughs')
+
+# %% [markdown]
+# *(NOTE: the maps no longer need separate notebooks. Instead of handing every reported crime to Plotly, the crimes of each period are counted once into a tile pyramid saved in tiles/ (the same one Analysis 4 uses for the pickups, and only rebuilt when the crime data changes), and the maps plot the map pixels of zoom level 11 (about 200 m) over New York City, lightly smoothed and weighted by their counts. The figures now take the same memory no matter how many crimes are in a period, so the cell runs as part of the report. All four maps share one color scale so the periods can be compared directly.)*
 
 # %%
-#|eval:False
 list_of_data=[data_2014_jantojune,data_2014_julytodec,data_2015_jantojune,data_2015_julytodec]
-for data in list_of_data:
-    fig = px.density_mapbox(data, 
+periods = ['crime_2014_jantojune', 'crime_2014_julytodec', 'crime_2015_jantojune', 'crime_2015_julytodec']
+nyc.build_tile_pyramid(dict(zip(periods, list_of_data)), lat='Latitude', lon='Longitude', key=nyc.data_key('crime'))
+density_grids = [nyc.query_tiles(name, boros.total_bounds, zoom=11, lat='Latitude', lon='Longitude', smooth=1) for name in periods]
+max_density = max(grid['count'].max() for grid in density_grids)
+for grid in density_grids:
+    fig = px.density_mapbox(grid, 
                             lat='Latitude', 
                             lon='Longitude', 
-                            radius=1,
+                            z='count',
+                            radius=6,
+                            range_color=(0, max_density),
                             zoom=9,
                             mapbox_style="stamen-terrain")
     fig.update_layout(
         mapbox={
             "layers":[{
-                "source":json.loads(boros.geometry.to_json()),
+                "source":nyc.borough_layer(zoom=9),
                 "type": "line",
                 "color": "black",
                 "line": {"width": 2},
@@ -608,11 +541,11 @@ for data in list_of_data:
 # After identifying the edges of the boroughs, I compared changes in reported crime density across New York using the maps. I determined that Manhattan had the highest reported crime density across all four periods, and Staten Island had the lowest crime density across all four periods. There is not too much change across this time period which makes sense because the time period is not very long. However, the heat density maps made it difficult to compare the actual number of crimes in each borough. I created a column with just the year and month of each reported crime and converted the type to datetime so that I could create a countplot of the reported crimes separated by borough. This countplot showed that Brooklyn had the highest number of reported crimes across 2014 and 2015, and Staten Island had the lowest number of reported crimes by a large margin across 2014 and 2015.
 
 # %%
-data_14_15['year_month'] = data_14_15['complaint_date'].dt.strftime('%Y, %m')
-data_14_15['year_month'] = pd.to_datetime(data_14_15['year_month'])
+crimes_by_month = nyc.cube_counts(time_cube, ['year', 'month', 'borough'], source='crime').reset_index()
+crimes_by_month['year_month'] = pd.to_datetime(crimes_by_month[['year', 'month']].assign(day=1))
 
 # %%
-ax = sns.countplot(x=data_14_15.year_month.sort_values(), hue='borough', data=data_14_15)
+ax = sns.barplot(x='year_month', y='count', hue='borough', data=crimes_by_month)
 ax.set_ylabel('Number of Reported Crimes', fontsize=20)
 ax.set_xlabel('Crime by Month', fontsize=20)
 ax.set_title('Number of Reported Crimes by Borough', fontsize=30)
@@ -627,6 +560,11 @@ ax.tick_params(axis='y', labelsize=15)
 # 
 # This analysis is important to answering the question "Is there a relationship between crime rates and ridesharing locations in NYC?" because it is useful to determine the areas with the least crime. Rideshare users would be interested to know which areas have lower crime densities because it may help them feel safer when using ridesharing services. Also rideshare The NYPD could also use this information for more effective crime fighting efforts. If they are focusing crime fighting efforts on areas where ridesharing pick-up and drop-offs are high to make transportation safer, it would be useful to know the reported crime density in that area. There are likely different plans of action for areas with high reported crime densities compared to low reported crime densities. Also, it may be easier to start in areas where reported crime is low and rideshare activity is high. This data can be cross referenced with ride sharing data to determine the relationship between the two and create a better experience for users and drivers.
 
+# %%
+del data_14_15, data_2014_jantojune, data_2014_julytodec, data_2015_jantojune, data_2015_julytodec, list_of_data, periods, density_grids
+nyc.release()
+nyc.live_datasets()
+
 # %% [markdown]
 # ### Analysis 4
 # *By Eli Nacar*
@@ -634,30 +572,52 @@ ax.tick_params(axis='y', labelsize=15)
 # For this section of the analysis, we chose to look at whether there was a difference in correlation between uber pickup locations, Lyft pickup locations, and crime density in New York City. Further expanding the analysis to check correlation values between different rideshare pickup locations and crime density. If it was found that one type of rideshare was more highly correlated to crime than another, exploring the reason for this difference in a separate analysis would gleam useful information for city policy makers, rideshare companies, and even common riders if it was discovered why one rideshare may correlate to a higher density of crime than the other. To explore this question, this analysis looked at the locations of each individual crime, uber, and lyft pickup within New York City, ultimately drawing a comparison between their correlation values. We believed that if we were able to illustrate how many crimes, ubers, and lyfts occured in each latitude/longitude pair, we could draw relevant conclusions concerning the correlation between these three values as well as expand the analysis to each borough.
 
 # %%
-crime_data = crime_14_15.copy()
-crime_data.rename(columns={'Latitude':'Lat', 'Longitude':'Lon'}, inplace=True)
+crime_data = crime_14_15.rename(columns={'Latitude':'Lat', 'Longitude':'Lon'})
 crime_data.head()
 
 # %%
 ### Importing LYFT Data
-lyft_data = pd.read_csv('other-LYFT_B02510.csv')
-lyft_data.drop('Unnamed: 3', axis=1, inplace=True)
-lyft_data.rename(columns={'start_lat':'Lat', 'start_lng':'Lon'}, inplace=True)
+lyft_data = nyc.dataset('lyft')
 lyft_data.head()
 
 # %%
 ### UBER Data
-uber_apr14 = one.copy()
-uber_may14 = five.copy()
-uber_jun14 = four.copy()
-uber_jul14 = three.copy()
-uber_aug14 = two.copy()
-uber_sep14 = six.copy()
-
-uber_datasets = [uber_apr14, uber_may14, uber_jun14, uber_jul14, uber_aug14, uber_sep14]
-uber_data = pd.concat(uber_datasets)
+uber_data = nyc.dataset('uber_2014')
 uber_data.head()
 
+# %% [markdown]
+# Before the coordinates are rounded, the exact crime, Uber, and Lyft locations are also counted into a tile pyramid saved in tiles/: counts at every map zoom level from the whole city (zoom 9) down to single blocks (zoom 16), with each level rolled up from the one below it. Any part of the city can then be mapped at any zoom by reading just the counts inside that area, instead of re-plotting millions of points. For example, crimes and pickups around Midtown Manhattan at block level:
+
+# %%
+# (rebuilt only when the crime, Lyft or 2014 Uber data changes)
+nyc.build_tile_pyramid({'crime': crime_data, 'uber': uber_data, 'lyft': lyft_data},
+                       key=nyc.data_key('crime', 'lyft', 'uber_2014'))
+
+# %%
+midtown = (-74.005, 40.740, -73.965, 40.770)
+for name in ['crime', 'uber', 'lyft']:
+    fig = px.density_mapbox(nyc.query_tiles(name, midtown, zoom=16),
+                            lat='Lat',
+                            lon='Lon',
+                            z='count',
+                            radius=4,
+                            zoom=13,
+                            center={'lat': 40.755, 'lon': -73.985},
+                            mapbox_style="stamen-terrain",
+                            title=name)
+    fig.update_layout(
+        mapbox={
+            "layers":[{
+                "source":nyc.borough_layer(zoom=13),
+                "type": "line",
+                "color": "black",
+                "line": {"width": 2},
+            }]
+        },
+        margin={"l": 0, "r": 0, "t": 30, "b": 0}
+    )
+    fig.show()
+
 # %% [markdown]
 # The latitude and longitude values for each individual dataframe were not normalized to a certain level of precision. In order to standardize, we set each latitude and longitude value to three decimal points of precision (equal to about a 110 square meter plot of land). What this means, is that essentially every crime, uber, and lyft pickup spot is generalized to have occurred within a tennis court sized plot of land in New York City. We were comfortable with this level of precision as it allowed for meaningful analysis while not sacrificing relevant precision. 
 
@@ -665,13 +625,9 @@ uber_data.head()
 ### Standardize Lat and Long to 3 Decimal Points
 # Three decimal point is worth 110 meters. 
 
-def round_3(x):
-    x['Lat'] = x['Lat'].apply(lambda x: round(x, 3))
-    x['Lon'] = x['Lon'].apply(lambda x: round(x, 3))
-    
-round_3(crime_data)
-round_3(lyft_data)
-round_3(uber_data)
+crime_data = nyc.round_cells(crime_data, 3)
+lyft_data = nyc.round_cells(lyft_data, 3)
+uber_data = nyc.round_cells(uber_data, 3)
 
 crime_data.head()
 
@@ -681,20 +637,6 @@ crime_data.head()
 # To make our analysis simpler, I concatenated all of the individual data frames into a single dataframe called "locations." Locations have every single unique latitude and longitude value within the dataset with other columns indicating the number of crimes, ubers, and lyfts at that specific latitude and longitude coordinate pair. This part of the analysis was very difficult since I could not figure out an efficient process for determining the number of crimes, ubers, and lyfts at a specific location since some locations had no crimes or no rideshares. I settled on utilizing another .apply with a lambda function to iterate through every location pair and return the row size of each data frame sliced to only include that location pair.
 # 
 
-# %%
-### Joining Data to create a comprehensive list of everything that happens at each lat and lon
-loc = uber_data.loc[:, ['Lat','Lon']]
-loc2 = lyft_data.loc[:, ['Lat', 'Lon']]
-loc3 = crime_data.loc[:, ['Lat', 'Lon']]
-
-# %%
-locations = pd.concat([loc, loc2, loc3])
-locations.value_counts()
-
-# %%
-locations.drop_duplicates(inplace=True)
-locations.value_counts()
-
 # %%
 ## Helper Functions
 def num_crime(x, y):
@@ -706,31 +648,46 @@ def num_uber(x, y):
 def num_lyft(x, y):
     return lyft_data.loc[(lyft_data['Lat'] == x) & (lyft_data['Lon'] == y), :].shape[0]
 
+# %% [markdown]
+# Running the helper functions through .apply meant scanning all three data frames once for every location pair, which took hours on the full Uber data. Instead, each data frame is grouped by its latitude and longitude once, and the counts are joined onto the location pairs. The helper functions above are kept as the reference the grouped counts are checked against: the benchmark below runs them on a random sample of 50 locations, checks their counts against the grouped ones, and reports both times and the speedup.
+
+# %%
+### Joining Data to create a comprehensive list of everything that happens at each lat and lon
+# (the 'cell_counts' stage counts every source into cells at 2, 3 and 4 decimals in one pass,
+# and 'locations' is the 3 decimal level)
+locations = nyc.dataset('locations')
+counted_sources = {'num_crime': crime_data, 'num_lyft': lyft_data, 'num_uber': uber_data}
+
 # %%
-locations['num_crime'] = locations.apply(lambda x: num_crime(x['Lat'], x['Lon']), axis=1)
-locations['num_lyft'] = locations.apply(lambda x: num_lyft(x['Lat'], x['Lon']), axis=1)
-locations['num_uber'] = locations.apply(lambda x: num_uber(x['Lat'], x['Lon']), axis=1)
+### Benchmark: helper functions (on a sample of locations) vs. grouped counts
+nyc.benchmark_cell_counts(locations[['Lat', 'Lon']], counted_sources,
+                          {'num_crime': num_crime, 'num_lyft': num_lyft, 'num_uber': num_uber}, sample=50)
 
 # %%
 locations.head()
 
+# %% [markdown]
+# *(NOTE: each point is counted once into a fine grid of 0.00001 degrees (about 1 m), whose cells line up with the edges of the 2, 3 and 4 decimal cells, and the counts of the fine cells are added up into each of those. Repeating the analysis at roughly 1.1 km or 11 m instead of 110 m only means picking another level:)*
+
+# %%
+cell_counts = nyc.dataset('cell_counts')
+pd.Series({decimals: len(counts) for decimals, counts in cell_counts.items()}, name='cells')
+
 # %% [markdown]
 # Once the data was compiled together, we ran a simple .corrwith the number of crimes and found a negligible correlation between Uber and crime but a weak positive correlation between lyft and crime. While these correlation values (0.1516 and 0.2384) are both relatively negligible, the difference between them sparked us to explore if there was any meaningful distinction between the correlation values within each borough. 
 # 
 # The process of defining each location within a borough was at first, very daunting. I anticipated the borough defining would be problematic but I was ultimately able to circumvent the issue by utilizing information from the uncleaned crime dataset. The uncleaned crime dataset actually includes the borough that each crime occurred in, through yet another .apply and lambda function, I was able to define each latitude and longitude pair to a borough. 
 
 # %%
-locations.corrwith(locations.num_crime).sort_values(ascending = False)
+#computed from per-borough sums of the counts, their squares and products (see the 'correlations' stage)
+correlations = nyc.dataset('correlations')
+correlations['with crime']
 
 # %%
 ### Borough v2
-def borough2(x, y):
-    if crime_data.loc[(crime_data['Lat']==x) & (crime_data['Lon']),:].shape[0] == 0:
-        return 'N/A'
-    else:
-        return crime_data.loc[(crime_data['Lat']==x) & (crime_data['Lon']),:].iloc[0]['borough']
-    
-locations['Borough'] = locations.apply(lambda x: borough2(x['Lat'], x['Lon']), axis=1)
+# each location takes the borough of the crimes reported there (or its borough outline
+# if no crime was), from a lookup that is built once and saved for later runs
+locations = locations.assign(Borough=nyc.dataset('location_boroughs'))
 
 locations_dummies = pd.get_dummies(locations['Borough'])
 locations = pd.concat([locations, locations_dummies], axis=1)
@@ -764,11 +721,51 @@ sns.pairplot(loc_heat, hue='Borough', kind='reg', plot_kws= dict(scatter_kws= di
 
 # %%
 ### Check correlation per Borough: Uber -> Crime
-locations.groupby('Borough').apply(lambda x: x['num_uber'].corr(x['num_crime'])).sort_values(ascending=False)
+correlations['uber by borough']
 
 # %%
 ### Check correlation per Borough: Lyft -> Crime
-locations.groupby('Borough').apply(lambda x: x['num_lyft'].corr(x['num_crime'])).sort_values(ascending=False)
+correlations['lyft by borough']
+
+# %% [markdown]
+# *(NOTE: the same sums give the correlations of the ranks of the counts (Spearman), which are less sensitive to the few locations with very many crimes or pickups, the correlations at 2 and 4 decimal cells, and the correlations within each month of the 2014 pickups:)*
+
+# %%
+correlations['spearman by borough']
+
+# %%
+correlations['by resolution']
+
+# %%
+correlations['by month']
+
+# %% [markdown]
+# *(NOTE: to see which of these correlations could be chance, the 'significance' stage resamples the locations: 2000 bootstrap resamples give a 95% interval for each correlation and for the difference between Lyft's and Uber's, and 2000 shuffles of the crime counts among the locations of the same 2 decimal cell (about 1.1 km) give a p-value that the correlation is only the neighbourhood-level overlap of crime and pickups:)*
+
+# %%
+significance = nyc.dataset('significance')
+significance.round(4).T
+
+# %% [markdown]
+# *(NOTE: counting inside the same 110 m cell misses a pickup one cell away from a crime hotspot, so every pickup also gets the number of 2014-2015 crimes reported within 100 m and 250 m of it, from a spatial index of the crime coordinates:)*
+
+# %%
+crime_radius = nyc.dataset('crime_radius')
+uber_data = uber_data.assign(**crime_radius['uber'])
+lyft_data = lyft_data.assign(**crime_radius['lyft'])
+
+### Average crimes around a pickup
+pd.DataFrame({'uber': crime_radius['uber'].mean(), 'lyft': crime_radius['lyft'].mean()})
+
+# %% [markdown]
+# *(NOTE: the counts above cover the whole two years; joining on time as well counts only the complaints reported within 250 m and one hour of each pickup. The 2015 Uber pickups have no coordinates, only a taxi zone, so they are left out:)*
+
+# %%
+spacetime_crime = nyc.dataset('spacetime_crime')
+pd.DataFrame({name: {'pickups': counts.notna().sum(),
+                     'average complaints nearby': counts.mean(),
+                     'share with a complaint nearby': (counts > 0).mean()}
+              for name, counts in spacetime_crime.items()})
 
 # %%
 ### Remove outliers 
@@ -787,6 +784,30 @@ plt.show()
 ax = sns.lmplot(data=no_outliers, x='num_uber', y='num_crime')
 ax.set(xlabel='Number of Ubers', ylabel='Number of Crimes', title='Relationship between Ubers and Crime in NYC')
 
+# %%
+print(f'peak RSS: {nyc.peak_rss():,.0f} MB')
+nyc.live_datasets()
+
+# %% [markdown]
+# *(NOTE: on a machine with less memory, the Analysis 1 borough tables and the Analysis 4 locations table can also be computed out of core, streaming every file in chunks that fit a memory budget and spilling the partial cell counts to disk (also `python nyc_rideshare.py --memory-budget 1GB`). The results are the same as above:)*
+
+# %%
+#|eval:false
+out_of_core = nyc.run_out_of_core('1GB')
+(out_of_core['borough_data'].equals(borough_data),
+ out_of_core['borough_data_15'].equals(borough_data_15),
+ out_of_core['locations'].equals(nyc.dataset('locations')))
+
+# %% [markdown]
+# *(NOTE: with more cores, the same three tables can be split across processes instead (also `python nyc_rideshare.py --workers 8`): every file is cut into shards of a million rows, each process counts its shards' cells and boroughs, and the partial counts are added up in a fixed order, so the results are again the same:)*
+
+# %%
+#|eval:false
+sharded = nyc.run_sharded()
+(sharded['borough_data'].equals(borough_data),
+ sharded['borough_data_15'].equals(borough_data_15),
+ sharded['locations'].equals(nyc.dataset('locations')))
+
 # %% [markdown]
 # ## Conclusions
 # From the onset, the aim of this analysis was to determine the relationship, if any, between rideshare usage and crime rates in New York City. To begin, the first analysis examined rideshare usage in each borough, in which it was determined that, by a large margin, the borough of Manhattan has the highest concentration of Uber rides called. Although this data only consists of portions of 2014 and 2015, the margin in which Manhattan dominates the percentage of Ubers called allows us to confidently assume that more generally, this borough is the main hotspot for Ubers. Logically this makes sense, as the business and cultural center of New York City (downtown New York City)  resides in this borough, causing one to suspect that the large majority of traffic in the city would be to and from this area. The second analysis visualized the steady growth that rideshare companies have had since 2015, and reflects their dominance over traditional VFH companies. Furthermore, the two bar plots displaying Uber and crime complaint counts show how the two have similar rates of occurrence on an hour-to-hour basis. These portions of analyses 1 and 2 reveal the large scale at which the ridesharing industry operates and its influence over the entire transportation landscape in New York City, as well as the similarities ridesharing rates and crime rates share throughout the course of the day. Thus, the group’s initial desire to determine how ridesharing and crime is justified.
@@ -0,0 +1,1846 @@
+### Helper functions for Ridesharing_and_Crime_in_NYC.py
+# The notebook got too slow to run top to bottom on the full Uber, Lyft and
+# NYPD data, so the heavy lifting lives here and the notebook calls into it.
+
+import functools
+import gc
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import resource
+import sys
+import time
+import types
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import shapely
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+
+### On-disk cache
+# Parsed data frames are saved as uncompressed Feather (Arrow IPC) files in CACHE_DIR and
+# memory-mapped on later loads instead of re-parsing the CSVs. The cache key covers the
+# size and modification time of every source file plus the loader arguments, so replacing
+# or editing a CSV (or changing how it is read) rebuilds that entry on the next load.
+# An entry is described by a cache spec, (name, sources, params): each loader has a
+# *_cache() function returning the spec of its entry, so where an entry lives is known
+# without loading or building it.
+
+CACHE_DIR = 'cache'
+
+
+def cache_key(sources, *params):
+    key = hashlib.sha1()
+    for source in sources:
+        stat = os.stat(source)
+        key.update(f'{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+    key.update(repr(params).encode())
+    return key.hexdigest()[:16]
+
+
+def cache_path(name, sources, params):
+    return os.path.join(CACHE_DIR, f'{name}-{cache_key(sources, *params)}.feather')
+
+
+def cached_frame(cache, build):
+    name, sources, params = cache
+    path = cache_path(name, sources, params)
+    if os.path.exists(path):
+        return feather.read_table(path, memory_map=True).to_pandas()
+
+    data = build()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for stale in glob.glob(os.path.join(CACHE_DIR, glob.escape(name) + '-*.feather')):
+        os.remove(stale)
+    feather.write_feather(data, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+    return data
+
+
+# the file of cache entry `name` (there is one per name, stale keys are removed on rebuild)
+def cache_entry(name):
+    return glob.glob(os.path.join(CACHE_DIR, glob.escape(name) + '-' + '?' * 16 + '.feather'))[0]
+
+
+# the cache spec of a CSV read with the pd.read_csv options `kwargs`
+def csv_cache(path, **kwargs):
+    return os.path.basename(path), [path], (sorted(kwargs.items()),)
+
+
+def read_csv_cached(cache):
+    name, (path,), (options,) = cache
+    return cached_frame(cache, lambda: pd.read_csv(path, **dict(options)))
+
+
+### Typed loaders
+# pd.read_csv's defaults give float64 coordinates, int64 counts and object columns for
+# every code and name. These loaders read each source with explicit dtypes instead:
+# float32 coordinates (~1 m at NYC's latitude, finer than the 110 m cells we use),
+# categoricals for bases, boroughs and offense levels, and the smallest integer type
+# that holds each count. Timestamps are parsed separately; the ones that repeat heavily
+# (whole minutes, dates, times of day) are read as categoricals so each distinct string
+# is stored once.
+
+UBER_2014_DTYPES = {'Date/Time': 'category', 'Lat': 'float32', 'Lon': 'float32', 'Base': 'category'}
+UBER_2015_DTYPES = {'Dispatching_base_num': 'category', 'Affiliated_base_num': 'category', 'locationID': 'int16'}
+LYFT_DTYPES = {'time_of_trip': 'category', 'start_lat': 'float32', 'start_lng': 'float32'}
+FHV_DTYPES = {'Base License Number': 'category', 'Base Name': 'category', 'DBA': 'category',
+              'Year': 'int16', 'Month': 'int8', 'Month Name': 'category',
+              'Total Dispatched Trips': 'int32', 'Total Dispatched Shared Trips': 'int32',
+              'Unique Dispatched Vehicles': 'int32'}
+TAXI_ZONE_DTYPES = {'LocationID': 'int16', 'Borough': 'category', 'Zone': 'category'}
+# NYPD columns in file order, after the index and the pre-computed year/month columns
+CRIME_COLUMNS = ['complaint_date', 'complaint_time', 'gen_description', 'pd_description', 'level_of_offense',
+                 'borough', 'location_type', 'Latitude', 'Longitude']
+CRIME_DTYPES = ['category', 'category', 'category', 'category', 'category', 'category', 'category', 'float32', 'float32']
+CRIME_DROPPED = ['Unnamed: 0', 'complaint_year', 'complaint_month']
+
+
+def uber_2014_cache(path):
+    return csv_cache(path, dtype=UBER_2014_DTYPES)
+
+
+def load_uber_2014(path):
+    return read_csv_cached(uber_2014_cache(path))
+
+
+def uber_2015_cache(path='uber-raw-data-janjune-15.csv'):
+    return csv_cache(path, dtype=UBER_2015_DTYPES)
+
+
+def load_uber_2015(path='uber-raw-data-janjune-15.csv'):
+    return read_csv_cached(uber_2015_cache(path))
+
+
+def lyft_cache(path='other-LYFT_B02510.csv'):
+    return csv_cache(path, usecols=list(LYFT_DTYPES), dtype=LYFT_DTYPES)
+
+
+def load_lyft(path='other-LYFT_B02510.csv'):
+    return read_csv_cached(lyft_cache(path))
+
+
+def fhv_report_cache(path='FHV_Base_Aggregate_Report.csv'):
+    return csv_cache(path, dtype=FHV_DTYPES)
+
+
+def load_fhv_report(path='FHV_Base_Aggregate_Report.csv'):
+    return read_csv_cached(fhv_report_cache(path))
+
+
+def taxi_zones_cache(path='taxi_zone_lookup.csv'):
+    return csv_cache(path, dtype=TAXI_ZONE_DTYPES)
+
+
+def load_taxi_zones(path='taxi_zone_lookup.csv'):
+    return read_csv_cached(taxi_zones_cache(path))
+
+
+# The NYPD history is read in chunks and each chunk is filtered as it is read, so only
+# complaints from `years` with both coordinates are ever kept in memory. Columns are
+# renamed to `names` (in file order) and complaint_year/complaint_month are added as
+# integers. The filtered result is cached like the other sources, keyed on the code of
+# the filter as well, so changing it rebuilds the entry.
+def crime_cache(path='NYPD_complaint_data.csv', names=None, years=(2014, 2015)):
+    names = None if names is None else list(names)
+    filter_code = hashlib.sha1(code_source(crime_chunks).encode()).hexdigest()[:16]
+    return 'crime-' + os.path.basename(path), [path], (names, years, filter_code)
+
+
+def load_crime(path='NYPD_complaint_data.csv', names=None, years=(2014, 2015), chunksize=500_000):
+    return cached_frame(crime_cache(path, names, years),
+                        lambda: concat_typed(crime_chunks(path, names, years, chunksize), ignore_index=True))
+
+
+# Complaint dates in CRIME_DATE_FORMAT; dates in any other layout are parsed one by one
+# (like the original pd.to_datetime(errors='coerce')), and a chunk whose dates all fail
+# to parse raises instead of being filtered out silently.
+def parse_crime_dates(values):
+    dates = parse_timestamps(values, CRIME_DATE_FORMAT, errors='coerce')
+    failed = (dates.isna() & values.notna()).to_numpy()
+    if failed.any():
+        dates[failed] = pd.to_datetime(values[failed].astype(str), format='mixed', errors='coerce').to_numpy()
+        if dates.isna().to_numpy()[values.notna().to_numpy()].all():
+            raise ValueError(f'no complaint date could be parsed, e.g. {values[failed].iloc[0]!r}')
+    return dates
+
+
+# the filtered chunks of load_crime, one at a time
+def crime_chunks(path='NYPD_complaint_data.csv', names=None, years=(2014, 2015), chunksize=500_000):
+    columns = pd.read_csv(path, nrows=0).columns.drop(CRIME_DROPPED)
+    names = list(columns) if names is None else list(names)
+    date, lat, lon = names[0], names[-2], names[-1]
+    for chunk in pd.read_csv(path, usecols=list(columns), dtype=dict(zip(columns, CRIME_DTYPES)), chunksize=chunksize):
+        chunk.columns = names
+        dates = parse_crime_dates(chunk[date])
+        keep = chunk[lat].notna() & chunk[lon].notna()
+        if years is not None:
+            keep &= dates.dt.year.isin(years)
+        chunk = chunk[keep]
+        dates = dates[keep]
+        yield chunk.assign(**{date: dates,
+                              'complaint_year': dates.dt.year.astype('int16'),
+                              'complaint_month': dates.dt.month.astype('int8')})
+
+
+# pd.concat turns categoricals with different categories into object columns, so
+# merge the categories first to keep the concatenated result compact.
+def concat_typed(frames, **kwargs):
+    frames = list(frames)
+    if all(isinstance(f, pd.Series) for f in frames):
+        if all(isinstance(f.dtype, pd.CategoricalDtype) for f in frames):
+            categories = pd.api.types.union_categoricals([f.array for f in frames], ignore_order=True).categories
+            frames = [f.cat.set_categories(categories) for f in frames]
+        return pd.concat(frames, **kwargs)
+
+    columns = {}
+    for f in frames:
+        for column, dtype in f.dtypes.items():
+            columns.setdefault(column, []).append(dtype)
+    for column, dtypes in columns.items():
+        if len(dtypes) == len(frames) and all(isinstance(d, pd.CategoricalDtype) for d in dtypes):
+            categories = pd.api.types.union_categoricals([f[column].array for f in frames], ignore_order=True).categories
+            frames = [f.assign(**{column: f[column].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, **kwargs)
+
+
+# Memory of each typed frame against the same file read with pd.read_csv's defaults.
+# The default read is measured on the first `sample` rows and scaled to the full length.
+def memory_report(frames, sample=100_000):
+    rows = []
+    for name, (path, data) in frames.items():
+        default = pd.read_csv(path, nrows=sample)
+        before = default.memory_usage(deep=True).sum() / max(len(default), 1) * len(data)
+        after = data.memory_usage(deep=True).sum()
+        rows.append({'dataset': name, 'rows': len(data), 'default (MB)': before / 2**20,
+                     'typed (MB)': after / 2**20, 'reduction': before / after})
+    return pd.DataFrame(rows).set_index('dataset')
+
+
+### Timestamp parsing
+# Each source's timestamps have one fixed layout, so they are parsed with an explicit
+# format rather than letting pandas infer it per element. When the strings repeat
+# heavily (whole minutes, dates, times of day) each distinct string is parsed once and
+# the result is broadcast back with the category/factorize codes.
+
+UBER_2014_TIME_FORMAT = '%m/%d/%Y %H:%M:%S'  # 4/1/2014 0:11:00
+UBER_2015_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # 2015-01-01 00:11:00
+CRIME_DATE_FORMAT = '%m/%d/%Y'               # 01/01/2014
+CRIME_TIME_FORMAT = '%H:%M:%S'               # 13:45:00
+LYFT_TIME_FORMAT = '%m/%d/%Y %H:%M'          # 9/4/2014 9:51
+
+
+def parse_timestamps(values, fmt, errors='raise'):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+        if len(uniques) > len(values) // 2:
+            return pd.to_datetime(values, format=fmt, errors=errors)
+
+    parsed = pd.to_datetime(uniques, format=fmt, errors=errors).to_numpy()
+    result = parsed[codes]
+    result[codes < 0] = np.datetime64('NaT')
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+### Grid aggregation
+# Counts how many rows of each source fall in every (Lat, Lon) cell. Each source
+# is hash-grouped once and the per-source counts are outer-joined, instead of
+# scanning every source once per location.
+#
+# Coordinates are quantized to integer cell indices rather than rounded floats. A point
+# is first snapped to the nearest point of a fixed 1e-5 degree lattice (CELL_LATTICE),
+# so coordinates with up to 5 decimals (the Uber files have 4) land exactly on their
+# lattice point whatever their float32/float64 error. Its index at `decimals` places is
+# then its lattice index rounded to a multiple of 10**(5 - decimals). A lattice point
+# exactly half way between two cells, such as 40.7215, goes where the original
+# round(x, 3) sent it: whichever way its float64 value happens to fall, found with one
+# round() call per distinct tie. Coordinates with up to 5 decimals therefore get the
+# same cells as before. Every lattice point belongs to one fixed cell at each level, so
+# counts on the lattice roll up exactly into any of the CELL_LEVELS without rescanning
+# the points. A cell id packs the latitude and longitude indices into one int64
+# (latitude in the high 32 bits). CELL_SCHEME names this quantization for anything
+# saved with cell coordinates in it.
+
+CELL_LATTICE = 5
+CELL_SCHEME = f'lattice{CELL_LATTICE}-round'
+CELL_LEVELS = (2, 3, 4)
+
+
+def cell_index(values, decimals=3, lattice=None):
+    if lattice is None:
+        lattice = np.rint(np.asarray(values, dtype=np.float64) * 10**CELL_LATTICE).astype(np.int64)
+    scale = 10**(CELL_LATTICE - decimals)
+    if scale == 1:
+        return lattice
+    index, offset = np.divmod(lattice, scale)
+    index += offset > scale // 2
+    ties = np.flatnonzero(offset == scale // 2)
+    if len(ties):
+        points, which = np.unique(lattice[ties], return_inverse=True)
+        up = [round(point / 10**CELL_LATTICE, decimals) > point / 10**CELL_LATTICE for point in points.tolist()]
+        index[ties] += np.asarray(up)[which]
+    return index
+
+
+def pack_cells(lat_index, lon_index):
+    return (np.asarray(lat_index, dtype=np.int64) << 32) | (np.asarray(lon_index, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def unpack_cells(ids):
+    ids = np.asarray(ids, dtype=np.int64)
+    return ids >> 32, (ids & 0xFFFFFFFF).astype(np.uint32).view(np.int32).astype(np.int64)
+
+
+# The cell ids at `decimals` of the rows with both coordinates, and which rows those are
+# (a row missing either coordinate is in no cell).
+def cell_ids(data, decimals=3, keys=('Lat', 'Lon')):
+    lat, lon = (data[key].to_numpy(dtype=np.float64, na_value=np.nan) for key in keys)
+    known = ~(np.isnan(lat) | np.isnan(lon))
+    return pack_cells(cell_index(lat[known], decimals), cell_index(lon[known], decimals)), known
+
+
+# Rounds Lat/Lon to `decimals` places; three decimals is about 110 m. Missing values stay NaN.
+def round_cells(data, decimals=3, keys=('Lat', 'Lon')):
+    rounded = {}
+    for key in keys:
+        values = data[key].to_numpy(dtype=np.float64, na_value=np.nan)
+        known = ~np.isnan(values)
+        rounded[key] = np.full(len(values), np.nan)
+        rounded[key][known] = cell_index(values[known], decimals) / 10**decimals
+    return data.assign(**rounded)
+
+
+# Per-source counts at every level of `levels`, from one pass over each source's points:
+# {decimals: frame indexed by cell id with the cell's Lat/Lon and one count column per source}.
+def multires_counts(sources, levels=CELL_LEVELS, keys=('Lat', 'Lon')):
+    lat, lon = keys
+    ids = [cell_ids(data, CELL_LATTICE, keys)[0] for data in sources.values()]
+    source = np.repeat(np.arange(len(ids)), [len(part) for part in ids])
+    lattice, cell = np.unique(np.concatenate(ids), return_inverse=True)
+    lattice_counts = np.bincount(source * len(lattice) + cell, minlength=len(ids) * len(lattice)).reshape(len(ids), -1)
+    lat_lattice, lon_lattice = unpack_cells(lattice)
+
+    counts = {}
+    for decimals in levels:
+        lat_index = cell_index(None, decimals, lattice=lat_lattice)
+        lon_index = cell_index(None, decimals, lattice=lon_lattice)
+        level, cell = np.unique(pack_cells(lat_index, lon_index), return_inverse=True)
+        level_lat, level_lon = unpack_cells(level)
+        columns = {lat: level_lat / 10**decimals, lon: level_lon / 10**decimals}
+        for name, row in zip(sources, lattice_counts):
+            columns[name] = np.bincount(cell, weights=row, minlength=len(level)).astype(np.int64)
+        counts[decimals] = pd.DataFrame(columns, index=pd.Index(level, name='cell'))
+    return counts
+
+
+def cell_counts(sources, keys=('Lat', 'Lon')):
+    keys = list(keys)
+    counts = [data.groupby(keys, sort=False).size().rename(name) for name, data in sources.items()]
+    return pd.concat(counts, axis=1, join='outer').fillna(0).astype('int64')
+
+
+# Adds one count column per source to `locations`, keeping its rows, order and index.
+# Locations with nothing from a source get 0, same as the old num_crime/num_uber/num_lyft helpers.
+def attach_counts(locations, sources, keys=('Lat', 'Lon')):
+    counts = cell_counts(sources, keys)
+    locations = locations.join(counts, on=list(keys))
+    locations[counts.columns] = locations[counts.columns].fillna(0).astype('int64')
+    return locations
+
+
+# Times the old per-location scan against attach_counts. `helpers` maps each count
+# column to its scan function f(lat, lon) (the notebook's num_crime/num_lyft/num_uber).
+# The scan is only run on a random sample of locations (the full table takes hours) and
+# extrapolated, and the sampled counts are checked against the grouped ones.
+def benchmark_cell_counts(locations, sources, helpers, sample=200, seed=0, keys=('Lat', 'Lon')):
+    lat, lon = keys
+    rows = np.random.default_rng(seed).choice(len(locations), size=min(sample, len(locations)), replace=False)
+    sampled = locations.iloc[rows]
+
+    start = time.perf_counter()
+    scanned = pd.DataFrame({name: sampled.apply(lambda x: helpers[name](x[lat], x[lon]), axis=1) for name in sources})
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grouped = attach_counts(locations, sources, keys)
+    group_time = time.perf_counter() - start
+
+    if not (grouped.iloc[rows][list(sources)].to_numpy() == scanned.to_numpy()).all():
+        raise AssertionError('grouped counts do not match the per-location scan')
+
+    scan_total = scan_time / len(rows) * len(locations)
+    return pd.Series({'locations': len(locations),
+                      'sampled locations': len(rows),
+                      'apply scan (s, extrapolated)': scan_total,
+                      'grouped pass (s)': group_time,
+                      'speedup': scan_total / group_time})
+
+
+### Borough labeling
+# Labels every point with the borough polygon from Borough_Boundaries.geojson that it
+# falls in, in one vectorized pass. The boroughs are rasterized once into `cell`-sized
+# boxes: a box that sits entirely inside one borough labels all of its points by lookup,
+# a box that touches no borough marks its points as outside, and only points in boxes
+# that straddle a shoreline or border get an exact point-in-polygon test, against the
+# borough outlines clipped to their box. Points outside every borough are left as NaN.
+
+def borough_raster(boros, cell=0.002, block=16):
+    minx, miny, maxx, maxy = boros.total_bounds
+    nx, ny = int(np.ceil((maxx - minx) / cell)), int(np.ceil((maxy - miny) / cell))
+    geoms = boros.geometry.to_numpy()
+
+    # boxes crossed by a borough outline (densified so no segment skips a box), widened by one box
+    coords = shapely.get_coordinates(shapely.segmentize(shapely.boundary(geoms), cell / 4))
+    edge = np.zeros((nx + 2, ny + 2), dtype=bool)
+    edge[np.clip(((coords[:, 0] - minx) // cell).astype('int64'), 0, nx - 1) + 1,
+         np.clip(((coords[:, 1] - miny) // cell).astype('int64'), 0, ny - 1) + 1] = True
+    edge = np.logical_or.reduce([edge[1 + dx:nx + 1 + dx, 1 + dy:ny + 1 + dy] for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny), indexing='ij')
+    ix, iy, edge = ix.ravel(), iy.ravel(), edge.ravel()
+
+    # every other box is wholly inside one borough or wholly outside, so its centre decides
+    # -1: outside every borough, -2: needs an exact test, otherwise the borough row
+    raster = np.full(nx * ny, -1)
+    inner = np.flatnonzero(~edge)
+    centres = shapely.points(minx + (ix[inner] + 0.5) * cell, miny + (iy[inner] + 0.5) * cell)
+    centre_idx, centre_boro = boros.sindex.query(centres, predicate='within')
+    raster[inner[centre_idx]] = centre_boro
+    raster[edge] = -2
+
+    # clip the boroughs to blocks of boxes first, then each block piece to its edge boxes,
+    # so exact tests only ever run against small pieces of outline
+    edges = np.flatnonzero(edge)
+    block_of = (ix[edges] // block) * (ny // block + 1) + iy[edges] // block
+    piece_boro, piece_geom = [], []
+    for b in np.unique(block_of):
+        cells = edges[block_of == b]
+        bx, by = ix[cells[0]] // block * block, iy[cells[0]] // block * block
+        block_bounds = (minx + bx * cell, miny + by * cell, minx + (bx + block) * cell, miny + (by + block) * cell)
+        boxes = shapely.box(minx + ix[cells] * cell, miny + iy[cells] * cell,
+                            minx + (ix[cells] + 1) * cell, miny + (iy[cells] + 1) * cell)
+        for boro in boros.sindex.query(shapely.box(*block_bounds)):
+            block_piece = shapely.clip_by_rect(geoms[boro], *block_bounds)
+            if block_piece.is_empty:
+                continue
+            clipped = shapely.intersection(block_piece, boxes)
+            keep = ~shapely.is_empty(clipped)
+            piece_boro.append(np.full(keep.sum(), boro))
+            piece_geom.append(clipped[keep])
+    pieces = gpd.GeoDataFrame({'boro': np.concatenate(piece_boro)}, geometry=np.concatenate(piece_geom), crs=boros.crs)
+    return {'origin': (minx, miny), 'cell': cell, 'shape': (nx, ny), 'raster': raster, 'pieces': pieces}
+
+
+def label_boroughs(data, boros, lat='Lat', lon='Lon', name_col='boro_name', raster=None):
+    if raster is None:
+        raster = borough_raster(boros)
+    x = data[lon].to_numpy(dtype='float64')
+    y = data[lat].to_numpy(dtype='float64')
+    (minx, miny), cell, (nx, ny) = raster['origin'], raster['cell'], raster['shape']
+
+    with np.errstate(invalid='ignore'):
+        ix = np.floor((x - minx) / cell)
+        iy = np.floor((y - miny) / cell)
+    on_grid = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    labels = np.full(len(x), -1)
+    labels[on_grid] = raster['raster'][ix[on_grid].astype('int64') * ny + iy[on_grid].astype('int64')]
+
+    # exact test for the boundary boxes, once per distinct coordinate pair
+    edge = np.flatnonzero(labels == -2)
+    labels[edge] = -1
+    if len(edge):
+        codes, pairs = pd.MultiIndex.from_arrays([y[edge], x[edge]]).factorize()
+        points = gpd.points_from_xy(pairs.get_level_values(1), pairs.get_level_values(0), crs=boros.crs)
+        point_idx, piece_idx = raster['pieces'].sindex.query(points, predicate='within')
+        pair_labels = np.full(len(pairs), -1)
+        pair_labels[point_idx] = raster['pieces']['boro'].to_numpy()[piece_idx]
+        labels[edge] = pair_labels[codes]
+
+    return pd.Categorical.from_codes(labels, categories=boros[name_col].to_numpy())
+
+
+### Location -> borough lookup
+# Boroughs for Analysis 4's (Lat, Lon) cells, in the NYPD spelling. A cell gets the borough
+# of the first crime reported in it; cells with no crime (or no borough on their crimes)
+# fall back to the borough polygon the cell falls in, and 'N/A' outside all five (saved as
+# a blank borough).
+# `cells` and `crime_data` are cells at `decimals` places. The lookup is saved to `path`,
+# whose name holds the decimals, CELL_SCHEME and `key` (the 'location_boroughs' stage
+# passes a key of the crime and borough data), so a lookup made at another resolution,
+# under another quantization or from other data is never reused; it is rebuilt and the
+# stale files of the same resolution and scheme are removed. Cells the saved lookup has
+# not seen yet are labeled and appended, so a change to the pickup data only labels its
+# new cells. With path=None nothing is saved.
+
+CELL_BOROUGHS = ['BRONX', 'BROOKLYN', 'MANHATTAN', 'N/A', 'QUEENS', 'STATEN ISLAND']
+CELL_BOROUGH_INDEX = 'cell_borough_index_{decimals}dp_{scheme}_{key}.csv'
+
+
+def cell_boroughs(cells, crime_data, boros, decimals=3, path=None, key=None, keys=('Lat', 'Lon')):
+    keys = list(keys)
+    if path is not None:
+        saved = set(glob.glob(path.format(decimals=decimals, scheme=CELL_SCHEME, key='*')))
+        path = path.format(decimals=decimals, scheme=CELL_SCHEME, key=key)
+        for stale in saved - {path}:
+            os.remove(stale)
+    if path is not None and os.path.exists(path):
+        lookup = pd.read_csv(path)
+        changed = False
+    else:
+        lookup = (crime_data.dropna(subset=['borough'])
+                            .groupby(keys, sort=False)['borough'].first()
+                            .rename('Borough').reset_index())
+        changed = True
+
+    missing = cells[keys].drop_duplicates().merge(lookup[keys], how='left', on=keys, indicator=True)
+    missing = missing.loc[missing['_merge'] == 'left_only', keys].reset_index(drop=True)
+    if len(missing):
+        missing['Borough'] = pd.Series(label_boroughs(missing, boros, lat=keys[0], lon=keys[1])).str.upper()
+        lookup = pd.concat([lookup, missing], ignore_index=True)
+        changed = True
+    if changed and path is not None:
+        lookup.to_csv(path, index=False)
+
+    boroughs = cells[keys].join(lookup.set_index(keys)['Borough'], on=keys)['Borough']
+    return pd.Categorical(boroughs, categories=CELL_BOROUGHS).fillna('N/A')
+
+
+### Tile pyramid
+# Pre-aggregated point counts for zooming from the whole city down to single blocks
+# without going back to the raw data. Cells are Web Mercator (slippy map) tiles split
+# into tile_bins x tile_bins pixels, so a level lines up with what the map shows at that
+# zoom. Counts are computed once at the finest zoom; every coarser level is a quadtree
+# rollup of the one below (halve the pixel coordinates and sum). Each level is saved as
+# a Feather file, path/<source>/z<zoom>.feather, sorted by pixel column then row.
+# pyramid.json records a key for the data (e.g. data_key() of the stages it comes from)
+# along with the build's code and parameters, and a pyramid whose key is current is not
+# rebuilt.
+
+def mercator_pixels(lat, lon, zoom, tile_bins=64):
+    n = 2 ** zoom * tile_bins
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    x = (np.asarray(lon, dtype='float64') + 180) / 360 * n
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n
+    return x, y
+
+
+def mercator_coords(x, y, zoom, tile_bins=64):
+    n = 2 ** zoom * tile_bins
+    lon = np.asarray(x, dtype='float64') / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype='float64') / n))))
+    return lat, lon
+
+
+def build_tile_pyramid(sources, path='tiles', zooms=range(9, 17), tile_bins=64, lat='Lat', lon='Lon', key=None):
+    zooms = sorted(zooms)
+    build_key = None if key is None else hashlib.sha1(f'{key}|{zooms}|{tile_bins}|{code_source(build_tile_pyramid)}'.encode()).hexdigest()[:16]
+    for name, data in sources.items():
+        meta_path = os.path.join(path, name, 'pyramid.json')
+        if build_key is not None and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f).get('key') == build_key:
+                    continue
+        points = data[[lat, lon]].dropna()
+        x, y = mercator_pixels(points[lat], points[lon], zooms[-1], tile_bins)
+        level = (pd.DataFrame({'x': np.floor(x).astype('int64'), 'y': np.floor(y).astype('int64')})
+                   .value_counts().rename('count').reset_index())
+
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+        previous = zooms[-1]
+        for zoom in reversed(zooms):
+            shift = 2 ** (previous - zoom)
+            if shift > 1:
+                level = (level.assign(x=level['x'] // shift, y=level['y'] // shift)
+                              .groupby(['x', 'y'], as_index=False)['count'].sum())
+            level = level.sort_values(['x', 'y'], ignore_index=True)
+            previous = zoom
+            feather.write_feather(level, os.path.join(path, name, f'z{zoom}.feather'), compression='uncompressed')
+
+        with open(meta_path, 'w') as f:
+            json.dump({'zooms': zooms, 'tile_bins': tile_bins, 'points': len(points), 'key': build_key}, f)
+
+
+# Counts of one source inside `bounds` (lon_min, lat_min, lon_max, lat_max) at `zoom`,
+# one row per pixel centre. Only the matching rows of the memory-mapped level are read.
+# With `smooth`, the pixels are smoothed with a Gaussian kernel of `smooth` pixels (a
+# binned KDE; pixels just outside `bounds` are read too so the edges are not thinned),
+# and the pixels above 1e-4 of the peak are returned with their smoothed counts.
+def query_tiles(name, bounds, zoom, path='tiles', lat='Lat', lon='Lon', smooth=None):
+    with open(os.path.join(path, name, 'pyramid.json')) as f:
+        meta = json.load(f)
+    zoom = min(max(zoom, meta['zooms'][0]), meta['zooms'][-1])
+    minx, miny, maxx, maxy = bounds
+    x0, y0 = np.floor(mercator_pixels(maxy, minx, zoom, meta['tile_bins'])).astype(int)
+    x1, y1 = np.floor(mercator_pixels(miny, maxx, zoom, meta['tile_bins'])).astype(int)
+    pad = int(np.ceil(3 * smooth)) if smooth else 0
+
+    table = feather.read_table(os.path.join(path, name, f'z{zoom}.feather'), memory_map=True)
+    inside = pc.and_(pc.and_(pc.greater_equal(table['x'], x0 - pad), pc.less_equal(table['x'], x1 + pad)),
+                     pc.and_(pc.greater_equal(table['y'], y0 - pad), pc.less_equal(table['y'], y1 + pad)))
+    cells = table.filter(inside).to_pandas()
+    if smooth:
+        grid = np.zeros((x1 - x0 + 1 + 2 * pad, y1 - y0 + 1 + 2 * pad))
+        grid[cells['x'] - x0 + pad, cells['y'] - y0 + pad] = cells['count']
+        grid = ndimage.gaussian_filter(grid, sigma=smooth, mode='constant', truncate=3.0)[pad:len(grid) - pad, pad:grid.shape[1] - pad]
+        ix, iy = np.nonzero(grid > grid.max() * 1e-4)
+        cells = pd.DataFrame({'x': ix + x0, 'y': iy + y0, 'count': grid[ix, iy]})
+    cells[lat], cells[lon] = mercator_coords(cells['x'] + 0.5, cells['y'] + 0.5, zoom, meta['tile_bins'])
+    return cells[[lat, lon, 'count']]
+
+
+### Borough overlay
+# The borough outlines drawn over the maps. Serializing the full-resolution GeoJSON for
+# every figure is slow and embeds ~3 MB of coordinates in each plot (and in the HTML
+# report), so the outlines are simplified once per tolerance level (keeping every ring
+# valid) and the same serialized layer is handed to every figure. The tolerances are
+# about half a screen pixel at the zooms they serve.
+
+BOROUGH_TOLERANCES = [(10, 0.0005), (13, 0.0001), (np.inf, 0.00002)]  # (up to zoom, degrees)
+
+
+@functools.lru_cache(maxsize=None)
+def borough_layers(path='Borough_Boundaries.geojson'):
+    geometry = gpd.read_file(path).geometry
+    return {tolerance: json.loads(geometry.simplify(tolerance, preserve_topology=True).to_json())
+            for _, tolerance in BOROUGH_TOLERANCES}
+
+
+def borough_layer(zoom, path='Borough_Boundaries.geojson'):
+    tolerance = next(tolerance for max_zoom, tolerance in BOROUGH_TOLERANCES if zoom <= max_zoom)
+    return borough_layers(path)[tolerance]
+
+
+### Base companies
+# The FHV report lists each base (Base License Number) with its name. The rideshare
+# companies report under a license of their own name, while the trip data only carries
+# dispatch base codes (e.g. B02512), so those bases are added from TRIP_BASES. The
+# lookup is built once and company columns are categoricals of COMPANIES, so filtering
+# by company compares integer codes instead of base name strings.
+
+RIDESHARE_COMPANIES = ['JUNO', 'LYFT', 'UBER', 'VIA']
+COMPANIES = pd.CategoricalDtype(RIDESHARE_COMPANIES + ['OTHER'])
+# Uber's dispatch bases in the 2014-2015 trip data, and the Lyft base of the Lyft trips
+TRIP_BASES = {'B02512': 'UBER', 'B02598': 'UBER', 'B02617': 'UBER', 'B02682': 'UBER',
+              'B02764': 'UBER', 'B02765': 'UBER', 'B02835': 'UBER', 'B02836': 'UBER',
+              'B02510': 'LYFT'}
+
+
+# Company of every base in `report`: its name if it is a rideshare company, otherwise OTHER.
+def base_companies(report):
+    names = report.drop_duplicates('Base License Number', keep='last').set_index('Base License Number')['Base Name']
+    names = pd.Series(names.astype(str).to_numpy(), index=names.index.astype(str))
+    companies = pd.concat([names.where(names.isin(RIDESHARE_COMPANIES), 'OTHER'), pd.Series(TRIP_BASES)])
+    return companies[~companies.index.duplicated(keep='first')].astype(COMPANIES)
+
+
+# Company of each base in `bases`, looked up once per distinct base; unknown bases are NaN.
+def base_company(bases, lookup):
+    bases = bases.astype('category')
+    codes = lookup.cat.codes.reindex(bases.cat.categories.astype(str), fill_value=-1).to_numpy()
+    base_codes = bases.cat.codes.to_numpy()
+    codes = np.where(base_codes >= 0, codes[base_codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=COMPANIES), index=bases.index, name='Company')
+
+
+### FHV report store
+# The TLC publishes the FHV Base Aggregate Report again every month with the new month
+# added. Rather than re-aggregating the whole report for every plot, its records are
+# kept in FHV_STORE, one Feather file per (Year, Month), keyed by (Base License Number,
+# Year, Month), next to a rollup of dispatched trips per (Year, Company). The rollup
+# holds sums and record counts, so averages over any set of companies can be read from
+# it. ingest_fhv() only opens the months it is given: records replacing stored ones
+# have their old values subtracted from the rollup and the new values added, so
+# history is never rescanned. Records carry the Company column the 'tlc_report' and
+# 'tlc_snapshot' stages attach from the base company lookup.
+
+FHV_STORE = 'fhv_store'
+FHV_KEY = ['Base License Number', 'Year', 'Month']
+
+
+def fhv_month_path(year, month, path=FHV_STORE):
+    return os.path.join(path, 'months', f'{year:04d}-{month:02d}.feather')
+
+
+# (Year, Month) of every month in the store
+def fhv_store_months(path=FHV_STORE):
+    names = sorted(glob.glob(os.path.join(path, 'months', '*.feather')))
+    return [tuple(int(part) for part in os.path.basename(name)[:-len('.feather')].split('-')) for name in names]
+
+
+# The stored rollup, rebuilt from the stored months if it is missing.
+def fhv_rollup(path=FHV_STORE):
+    rollup_path = os.path.join(path, 'rollup.feather')
+    if os.path.exists(rollup_path):
+        return feather.read_feather(rollup_path)
+    empty = pd.DataFrame({'Year': pd.Series(dtype='int16'), 'Company': pd.Series(dtype=COMPANIES),
+                          'trips': pd.Series(dtype='int64'), 'records': pd.Series(dtype='int64')})
+    months = [_fhv_contribution(feather.read_feather(fhv_month_path(year, month, path)))
+              for year, month in fhv_store_months(path)]
+    if not months:
+        return empty
+    rollup = pd.concat(months).groupby(level=['Year', 'Company'], observed=True).sum().reset_index()
+    _write_feather(rollup, rollup_path)
+    return rollup
+
+
+def _fhv_contribution(records):
+    return records.groupby(['Year', 'Company'], observed=True)['Total Dispatched Trips'].agg(trips='sum', records='size').astype('int64')
+
+
+def ingest_fhv(report, path=FHV_STORE):
+    rollup = fhv_rollup(path).set_index(['Year', 'Company'])
+    os.makedirs(os.path.join(path, 'months'), exist_ok=True)
+    for (year, month), records in report.groupby(['Year', 'Month'], sort=True):
+        month_path = fhv_month_path(year, month, path)
+        records = records.drop_duplicates(FHV_KEY, keep='last')
+        rollup = rollup.add(_fhv_contribution(records), fill_value=0)
+        if os.path.exists(month_path):
+            stored = feather.read_feather(month_path)
+            replaced = stored.set_index(FHV_KEY).index.isin(records.set_index(FHV_KEY).index)
+            rollup = rollup.sub(_fhv_contribution(stored[replaced]), fill_value=0)
+            records = concat_typed([stored[~replaced], records], ignore_index=True)
+        _write_feather(records.reset_index(drop=True), month_path)
+    rollup = rollup[rollup['records'] > 0].astype('int64').reset_index().astype({'Company': COMPANIES})
+    _write_feather(rollup, os.path.join(path, 'rollup.feather'))
+    return rollup
+
+
+# Compares two snapshots of the report in one chunked pass over each file. Every record
+# is hashed twice, by its key and by its values; the old snapshot's key hashes are
+# indexed and each chunk of the new snapshot is looked up in that index, so records are
+# sorted into added (new key), revised (same key, different values) and unchanged, and
+# old keys never looked up are removed. 'merged' is the canonical table: the new
+# snapshot's records plus the removed ones, which the new snapshot no longer carries.
+# Every table carries the Company of its bases, from the base company lookup of
+# 'merged' (the one the 'base_companies' stage builds), so 'changes' (added and
+# revised records) can be passed to ingest_fhv() to bring the store up to the new
+# snapshot.
+def diff_fhv_snapshots(old_path, new_path, chunksize=100_000):
+    def hashed_chunks(path):
+        for chunk in pd.read_csv(path, dtype=FHV_DTYPES, chunksize=chunksize):
+            values = chunk.columns.drop(FHV_KEY)
+            yield chunk.assign(_key=pd.util.hash_pandas_object(chunk[FHV_KEY], index=False).to_numpy(),
+                               _row=pd.util.hash_pandas_object(chunk[values], index=False).to_numpy())
+
+    old = concat_typed(hashed_chunks(old_path), ignore_index=True)
+    old_keys = pd.Index(old['_key'])
+    seen = np.zeros(len(old), dtype=bool)
+    new, status = [], []
+    for chunk in hashed_chunks(new_path):
+        position = old_keys.get_indexer(chunk['_key'])
+        found = position >= 0
+        seen[position[found]] = True
+        revised = np.zeros(len(chunk), dtype=bool)
+        revised[found] = old['_row'].to_numpy()[position[found]] != chunk['_row'].to_numpy()[found]
+        status.append(np.where(~found, 'added', np.where(revised, 'revised', 'unchanged')))
+        new.append(chunk)
+    new = concat_typed(new, ignore_index=True).assign(status=np.concatenate(status))
+    removed = old[~seen].assign(status='removed')
+    merged = concat_typed([new, removed], ignore_index=True).sort_values(FHV_KEY, ignore_index=True)
+    companies = base_companies(merged)
+    new, removed, merged = (records.assign(Company=base_company(records['Base License Number'], companies))
+                            for records in (new, removed, merged))
+
+    previous = old.set_index('_key').drop(columns=FHV_KEY + ['_row']).add_suffix(' (old)')
+    revised = new[new['status'] == 'revised'].join(previous, on='_key')
+    summary = merged['status'].value_counts().reindex(['unchanged', 'revised', 'added', 'removed'], fill_value=0)
+    return {'summary': summary,
+            'added': new[new['status'] == 'added'].drop(columns=['_key', '_row']),
+            'revised': revised.drop(columns=['_key', '_row']),
+            'removed': removed.drop(columns=['_key', '_row']),
+            'changes': new[new['status'].isin(['added', 'revised'])].drop(columns=['_key', '_row', 'status']),
+            'merged': merged.drop(columns=['_key', '_row'])}
+
+
+# Adds the months of `report` from the latest stored month on (that month may have been
+# partial) and returns the updated rollup.
+def update_fhv_store(report, path=FHV_STORE):
+    stored = fhv_store_months(path)
+    if stored:
+        year, month = stored[-1]
+        report = report[report['Year'].astype(int) * 12 + report['Month'] >= year * 12 + month]
+    return ingest_fhv(report, path)
+
+
+# Average dispatched trips per base and month for each year (and each value of `by`),
+# the same means sns.barplot and pivot_table compute from the report's records.
+def fhv_yearly(rollup, by=None):
+    keys = ['Year'] if by is None else ['Year', by]
+    totals = rollup.groupby(keys, observed=True)[['trips', 'records']].sum()
+    return (totals['trips'] / totals['records']).rename('Total Dispatched Trips').reset_index()
+
+
+def _write_feather(data, path):
+    feather.write_feather(data, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+
+
+### Time-bucket cube
+# Counts of Uber pickups, Lyft pickups and crime complaints by source, year, month,
+# day, day of week, hour and borough, built with a single bincount over all records.
+# The time charts read slices of it (cube_counts) instead of re-deriving .dt.hour and
+# friends from the ~19M raw rows for every plot. Records with an unknown hour or
+# borough are counted with hour -1 / a missing borough, and left out when grouping by
+# that dimension, as value_counts() leaves out missing values.
+
+CUBE_SOURCES = ['uber', 'lyft', 'crime']
+BOROUGHS = ['BRONX', 'BROOKLYN', 'MANHATTAN', 'QUEENS', 'STATEN ISLAND']
+CUBE_DIMS = ['source', 'year', 'month', 'day', 'dayofweek', 'hour', 'borough']
+
+
+# Position of each value in `labels` (case-insensitive), -1 if missing or not found;
+# looked up once per distinct value.
+def _label_codes(values, labels):
+    values = pd.Series(values).astype('category')
+    lookup = pd.Index(labels).get_indexer(values.cat.categories.astype(str).str.upper())
+    codes = values.cat.codes.to_numpy()
+    return np.where(codes >= 0, lookup[codes], -1)
+
+
+# records is a list of (source, timestamps, boroughs) or (source, dates, boroughs, hours)
+# tuples, where hours (-1 if unknown) replaces the hour of the timestamps.
+def time_cube(records, years=(2014, 2015)):
+    shape = (len(CUBE_SOURCES), len(years), 12, 31, 7, 25, len(BOROUGHS) + 1)
+    counts = np.zeros(np.prod(shape), dtype=np.int64)
+    for source, times, boroughs, *hours in records:
+        times = pd.DatetimeIndex(times)
+        year = pd.Index(years).get_indexer(times.year)
+        keep = (year >= 0) & ~times.isna()
+        kept = times[keep]
+        hour = np.asarray(hours[0], dtype=np.int64)[keep] if hours else kept.hour.to_numpy(dtype=np.int64)
+        cell = np.ravel_multi_index((np.full(keep.sum(), CUBE_SOURCES.index(source)), year[keep],
+                                     kept.month.to_numpy(dtype=np.int64) - 1, kept.day.to_numpy(dtype=np.int64) - 1,
+                                     kept.dayofweek.to_numpy(dtype=np.int64), hour + 1,
+                                     _label_codes(boroughs, BOROUGHS)[keep] + 1), shape)
+        counts += np.bincount(cell, minlength=counts.size)
+
+    cells = np.flatnonzero(counts)
+    source, year, month, day, dayofweek, hour, borough = np.unravel_index(cells, shape)
+    return pd.DataFrame({'source': pd.Categorical.from_codes(source, CUBE_SOURCES),
+                         'year': np.asarray(years, dtype=np.int16)[year],
+                         'month': (month + 1).astype(np.int8),
+                         'day': (day + 1).astype(np.int8),
+                         'dayofweek': dayofweek.astype(np.int8),
+                         'hour': (hour - 1).astype(np.int8),
+                         'borough': pd.Categorical.from_codes(borough - 1, BOROUGHS),
+                         'count': counts[cells]})
+
+
+# Counts grouped by the dimension(s) `by`, over the cube cells matching every filter
+# (a value or a list of values per dimension), e.g. cube_counts(cube, 'hour', source='uber').
+def cube_counts(cube, by, **filters):
+    by = [by] if isinstance(by, str) else list(by)
+    keep = np.ones(len(cube), dtype=bool)
+    for dim, value in filters.items():
+        keep &= cube[dim].isin(value if pd.api.types.is_list_like(value) else [value]).to_numpy()
+    for dim in by:
+        keep &= (cube[dim] >= 0).to_numpy() if dim == 'hour' else cube[dim].notna().to_numpy()
+    return cube[keep].groupby(by, observed=True)['count'].sum()
+
+
+### Correlation statistics
+# Pearson correlations from sufficient statistics: per group, the number of rows and
+# the sums of every column and of every product of two columns. Statistics of
+# different chunks of rows (or from different workers) are merged by adding them, and
+# with integer counts the sums stay int64, so merging is exact. Correlations are only
+# computed at the end, from the merged statistics, in exact integer arithmetic. The
+# Spearman correlation is the Pearson correlation of ranks; rank_within() ranks inside
+# each group, which needs the whole group, so ranked statistics are not mergeable.
+
+def corr_stats(data, columns, by=None):
+    columns = list(columns)
+    terms = {'n': np.ones(len(data), dtype=np.int64)}
+    for i, a in enumerate(columns):
+        terms[f'sum({a})'] = data[a].to_numpy()
+        for b in columns[i:]:
+            terms[f'sum({a}*{b})'] = data[a].to_numpy() * data[b].to_numpy()
+    terms = pd.DataFrame(terms, index=data.index)
+    if by is None:
+        return terms.sum().to_frame('all').T
+    return terms.groupby(data[by] if isinstance(by, str) else by, observed=True).sum()
+
+
+# Adds up statistics of the same groups; pass group=False to merge all groups into one.
+def merge_corr_stats(stats, group=True):
+    stats = pd.concat(stats) if isinstance(stats, (list, tuple)) else stats
+    if not group:
+        return stats.sum().to_frame('all').T
+    return stats.groupby(level=list(range(stats.index.nlevels)), observed=True).sum()
+
+
+# Pearson correlation of x and y in every group of `stats` (NaN if either is constant).
+def pearson(stats, x, y):
+    def total(*names):
+        for name in (f"sum({'*'.join(names)})", f"sum({'*'.join(names[::-1])})"):
+            if name in stats:
+                return stats[name].astype(object)
+        raise KeyError(f'no statistics for {names}')
+
+    n = stats['n'].astype(object)
+    covariance = n * total(x, y) - total(x) * total(y)
+    variance = (n * total(x, x) - total(x) ** 2) * (n * total(y, y) - total(y) ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (covariance.astype(float) / np.sqrt(variance.astype(float))).rename(f'{x} ~ {y}')
+
+
+# Every column of `columns` correlated with `target`, over all groups (like DataFrame.corrwith).
+def corr_with(stats, columns, target):
+    stats = merge_corr_stats(stats, group=False)
+    return pd.Series({column: pearson(stats, column, target).iloc[0] for column in columns})
+
+
+# Average ranks of `columns` within each group, doubled so they stay integers (ties
+# get .5 ranks); Pearson statistics of these give Spearman correlations.
+def rank_within(data, columns, by=None):
+    ranked = data[columns] if by is None else data.groupby(by, observed=True)[columns]
+    return data.assign(**(ranked.rank() * 2).astype('int64'))
+
+
+### Resampling
+# Uncertainty of the pickup/crime correlations. A bootstrap replicate resamples cells
+# with replacement, kept as a row of per-cell counts, so a batch of replicates is a
+# handful of count-matrix products with the centred columns. Permutation replicates
+# shuffle the crime counts among the cells of the same spatial block (e.g. the 2
+# decimal cell, about 1.1 km), which keeps the city-wide pattern of where crime and
+# pickups are common and only tests whether they go together at the finer scale;
+# blocks=None shuffles across the whole group. A batch of shuffles is one sort of
+# int64 keys packing (block, random bits, position) per row, and only the
+# cross-product changes under a permutation, so it is one matrix product too.
+# Batches run in a process pool, each with its own seed from `seed`.
+
+def spatial_blocks(data, decimals=2, keys=('Lat', 'Lon')):
+    lat, lon = keys
+    return pd.Series(pack_cells(cell_index(data[lat], decimals), cell_index(data[lon], decimals)), index=data.index)
+
+
+def _pearson_rows(n, sx, sy, sxx, syy, sxy):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (n * sxy - sx * sy) / np.sqrt((n * sxx - sx**2) * (n * syy - sy**2))
+
+
+# x is (cells, columns), y is (cells,), block is sorted codes from 0; returns
+# (bootstrap r, permuted r), each (replicates, columns).
+def _resample_batch(x, y, block, replicates, seed):
+    rng = np.random.default_rng(seed)
+    n = len(y)
+    draws = rng.integers(0, n, size=(replicates, n)) + (np.arange(replicates) * n)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=replicates * n).reshape(replicates, n).astype(np.float64)
+    bootstrap = _pearson_rows(n, weights @ x, (weights @ y)[:, None], weights @ (x * x),
+                              (weights @ (y * y))[:, None], weights @ (x * y[:, None]))
+
+    position_bits = max(n - 1, 1).bit_length()
+    random_bits = 63 - position_bits - max(int(block[-1]), 1).bit_length()
+    keys = rng.integers(0, 1 << random_bits, size=(replicates, n), dtype=np.int64) << position_bits
+    keys |= (block.astype(np.int64) << (random_bits + position_bits)) | np.arange(n)
+    keys.sort(axis=1)
+    permuted_y = y[keys & ((1 << position_bits) - 1)]
+    permuted = _pearson_rows(n, x.sum(axis=0), y.sum(), (x * x).sum(axis=0), (y * y).sum(), permuted_y @ x)
+    return bootstrap, permuted
+
+
+# percentile interval of the finite replicates (constant resamples have no correlation)
+def _interval(replicates, alpha):
+    replicates = replicates[np.isfinite(replicates)]
+    if len(replicates) == 0:
+        return np.nan, np.nan
+    return tuple(np.quantile(replicates, [alpha, 1 - alpha]))
+
+
+# Correlation of every column of `x_columns` with `y` per group of `by` (and over all
+# cells), with a bootstrap confidence interval and a permutation p-value (two-sided),
+# plus the interval of the difference between the first two columns' correlations.
+def resample_correlations(data, x_columns, y, by=None, blocks=None, replicates=2000, confidence=0.95,
+                          seed=0, batch=100, workers=None):
+    x_columns = list(x_columns)
+    groups = [('all', data.index)]
+    if by is not None:
+        groups += list(data.groupby(by, observed=True).groups.items())
+    block = np.zeros(len(data), dtype=np.int64) if blocks is None else pd.factorize(pd.Series(blocks, index=data.index))[0]
+    block = pd.Series(block, index=data.index)
+
+    tasks = []
+    for name, index in groups:
+        rows = data.loc[index]
+        order = np.argsort(block.loc[index].to_numpy(), kind='stable')
+        x = rows[x_columns].to_numpy(dtype=np.float64)[order]
+        values = rows[y].to_numpy(dtype=np.float64)[order]
+        x, values = x - x.mean(axis=0), values - values.mean()
+        group_block = pd.factorize(block.loc[index].to_numpy()[order])[0]
+        sizes = [min(batch, replicates - start) for start in range(0, replicates, batch)]
+        tasks += [(name, x, values, group_block, size) for size in sizes]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+
+    jobs = [(x, values, group_block, size, task_seed) for (_, x, values, group_block, size), task_seed in zip(tasks, seeds)]
+    if workers == 1 or os.cpu_count() == 1:
+        results = [_resample_batch(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_resample_batch, *zip(*jobs)))
+
+    alpha = (1 - confidence) / 2
+    rows = {}
+    for name, index in groups:
+        bootstrap = np.concatenate([r[0] for (group, *_), r in zip(tasks, results) if group == name])
+        permuted = np.concatenate([r[1] for (group, *_), r in zip(tasks, results) if group == name])
+        stats = corr_stats(data.loc[index], x_columns + [y])
+        row = {}
+        for i, column in enumerate(x_columns):
+            observed = pearson(stats, column, y).iloc[0]
+            row[f'{column} r'] = observed
+            row[f'{column} low'], row[f'{column} high'] = _interval(bootstrap[:, i], alpha)
+            row[f'{column} p'] = (1 + np.sum(np.abs(permuted[:, i]) >= abs(observed))) / (1 + len(permuted)) \
+                if np.isfinite(observed) else np.nan
+        if len(x_columns) > 1:
+            difference = f'{x_columns[1]} - {x_columns[0]}'
+            row[f'{difference} low'], row[f'{difference} high'] = _interval(bootstrap[:, 1] - bootstrap[:, 0], alpha)
+        rows[name] = row
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+### Radius queries
+# How many crimes were reported within r meters of each pickup, instead of only in the
+# pickup's own cell. Points are placed on the unit sphere, where the straight-line
+# (chord) distance between two points is 2 sin(d / 2R) for their great-circle distance
+# d, so a k-d tree over those vectors answers haversine radius queries exactly. Pickups
+# repeat the same coordinates a lot, so each distinct (Lat, Lon) pair is queried once,
+# at its exact coordinates, in batches, with the tree's queries spread over `workers`
+# threads (-1 for all cores).
+
+EARTH_RADIUS = 6_371_008.8  # mean radius, meters
+
+
+def unit_vectors(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_length(meters):
+    return 2 * np.sin(np.asarray(meters, dtype=np.float64) / (2 * EARTH_RADIUS))
+
+
+def point_tree(data, keys=('Lat', 'Lon')):
+    lat, lon = keys
+    points = data[[lat, lon]].dropna()
+    return cKDTree(unit_vectors(points[lat], points[lon]))
+
+
+# Number of the tree's points within `radius` meters of every row of `data`, as an
+# int32 array in row order (0 for rows without coordinates).
+def count_within(tree, data, radius, keys=('Lat', 'Lon'), batch=1_000_000, workers=-1):
+    lat, lon = keys
+    known = (data[lat].notna() & data[lon].notna()).to_numpy()
+    row, pairs = pd.MultiIndex.from_arrays([data[lat].to_numpy()[known], data[lon].to_numpy()[known]]).factorize()
+    point_lat, point_lon = pairs.get_level_values(0).to_numpy(), pairs.get_level_values(1).to_numpy()
+    chord = chord_length(radius)
+
+    counts = np.empty(len(pairs), dtype=np.int32)
+    for start in range(0, len(pairs), batch):
+        stop = start + batch
+        vectors = unit_vectors(point_lat[start:stop], point_lon[start:stop])
+        counts[start:stop] = tree.query_ball_point(vectors, chord, return_length=True, workers=workers)
+
+    within = np.zeros(len(data), dtype=np.int32)
+    within[known] = counts[row]
+    return within
+
+
+# One 'crimes within {r} m' column per radius, indexed like `data`.
+def radius_counts(tree, data, radii, keys=('Lat', 'Lon'), batch=1_000_000, workers=-1):
+    return pd.DataFrame({f'crimes within {radius} m': count_within(tree, data, radius, keys, batch, workers) for radius in radii},
+                        index=data.index)
+
+
+### Space-time join
+# For every pickup, the number of complaints within `radius` meters and `window` of
+# its time. Complaints are bucketed into square cells at least `radius` wide and sorted
+# by (cell, time), so the candidates of a pickup are the complaints of the 3x3 cells
+# around its own whose times fall in the window, found with binary searches; only those
+# candidates are checked for their great-circle distance. Pickups are joined in time
+# order, `chunksize` at a time, against just the complaints in the chunk's time span
+# +/- window, and the candidate pairs of a chunk are expanded at most `max_pairs` at a
+# time, so memory stays bounded by the chunk and never grows with pickups x complaints.
+
+SPACETIME_LATITUDE = 41.0  # cells are sized with the cosine of NYC's northern edge, so they are never narrower than r
+
+
+def event_seconds(times):
+    times = pd.DatetimeIndex(times)
+    return np.where(times.isna(), np.iinfo(np.int64).min, times.to_numpy('datetime64[s]').astype(np.int64))
+
+
+# complaint_date plus the time of day in complaint_time
+def crime_times(crime, date='complaint_date', time='complaint_time'):
+    clock = parse_timestamps(crime[time], CRIME_TIME_FORMAT, errors='coerce')
+    return crime[date] + (clock - clock.dt.normalize())
+
+
+def _spacetime_cells(lat, lon, radius):
+    y = np.floor(np.radians(lat) * EARTH_RADIUS / radius).astype(np.int64)
+    x = np.floor(np.radians(lon) * EARTH_RADIUS * np.cos(np.radians(SPACETIME_LATITUDE)) / radius).astype(np.int64)
+    return y, x
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+# pickups and events are (times, lat, lon); returns an Int32 array in pickup order,
+# missing for pickups without a time or coordinates (e.g. the 2015 Uber pickups).
+def spacetime_counts(pickups, events, radius=250, window=pd.Timedelta(hours=1), chunksize=1_000_000, max_pairs=10_000_000):
+    window = int(pd.Timedelta(window).total_seconds())
+    p_time, p_lat, p_lon = event_seconds(pickups[0]), np.asarray(pickups[1], np.float64), np.asarray(pickups[2], np.float64)
+    e_time, e_lat, e_lon = event_seconds(events[0]), np.asarray(events[1], np.float64), np.asarray(events[2], np.float64)
+
+    keep = (e_time != np.iinfo(np.int64).min) & np.isfinite(e_lat) & np.isfinite(e_lon)
+    order = np.argsort(e_time[keep], kind='stable')
+    e_time, e_lat, e_lon = e_time[keep][order], e_lat[keep][order], e_lon[keep][order]
+    e_cell = pack_cells(*_spacetime_cells(e_lat, e_lon, radius))
+
+    known = np.flatnonzero((p_time != np.iinfo(np.int64).min) & np.isfinite(p_lat) & np.isfinite(p_lon))
+    known = known[np.argsort(p_time[known], kind='stable')]
+    counts = np.zeros(len(p_time), dtype=np.int32)
+
+    for start in range(0, len(known), chunksize):
+        rows = known[start:start + chunksize]
+        t, lat, lon = p_time[rows], p_lat[rows], p_lon[rows]
+        first = np.searchsorted(e_time, t[0] - window, side='left')
+        last = np.searchsorted(e_time, t[-1] + window, side='right')
+        if first == last:
+            continue
+
+        # this chunk's complaints sorted by (cell, time), as one int64 key
+        base, span = t[0] - window, t[-1] - t[0] + 2 * window + 1
+        cells, cell = np.unique(e_cell[first:last], return_inverse=True)
+        keys = cell * span + (e_time[first:last] - base)
+        by_key = np.argsort(keys, kind='stable')
+        keys, c_lat, c_lon = keys[by_key], e_lat[first:last][by_key], e_lon[first:last][by_key]
+
+        y, x = _spacetime_cells(lat, lon, radius)
+        chunk_counts = np.zeros(len(rows), dtype=np.int32)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                neighbour = pack_cells(y + dy, x + dx)
+                code = np.minimum(np.searchsorted(cells, neighbour), len(cells) - 1)
+                found = cells[code] == neighbour
+                lo = np.searchsorted(keys, code * span + (t - window - base), side='left')
+                hi = np.searchsorted(keys, code * span + (t + window - base), side='right')
+                candidates = np.where(found, hi - lo, 0)
+
+                # expand the (pickup, complaint) candidate pairs in slices of at most max_pairs
+                ends = np.cumsum(candidates)
+                splits = np.searchsorted(ends, np.arange(max_pairs, ends[-1], max_pairs), side='left') + 1
+                for part in np.split(np.arange(len(rows)), splits):
+                    if len(part) == 0 or candidates[part].sum() == 0:
+                        continue
+                    n = candidates[part]
+                    pair = np.repeat(part, n)
+                    event = np.repeat(lo[part], n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+                    near = _haversine(lat[pair], lon[pair], c_lat[event], c_lon[event]) <= radius
+                    chunk_counts += np.bincount(pair[near], minlength=len(rows)).astype(np.int32)
+        counts[rows] = chunk_counts
+
+    result = pd.array(counts, dtype='Int32')
+    missing = np.ones(len(p_time), dtype=bool)
+    missing[known] = False
+    result[missing] = pd.NA
+    return result
+
+
+### Lagged cross-correlation
+# How pickups and complaints line up hour by hour: hourly count series per borough or
+# grid cell for both sources, and the correlation of the pickup series with the
+# complaint series shifted by every lag, from -max_lag to +max_lag hours. A positive
+# lag means complaints follow pickups. Each series is standardized, and the products
+# over all shifts of all pairs of series come from one batch of real FFTs along the
+# time axis, zero-padded so they do not wrap around, `batch` series at a time.
+
+def hourly_counts(times, keys, labels, start, hours):
+    seconds = event_seconds(times)
+    hour = (seconds - int(pd.Timestamp(start).timestamp())) // 3600
+    code = pd.Index(labels).get_indexer(keys)
+    keep = (seconds != np.iinfo(np.int64).min) & (hour >= 0) & (hour < hours) & (code >= 0)
+    return np.bincount(code[keep] * hours + hour[keep], minlength=len(labels) * hours).reshape(len(labels), hours)
+
+
+def _standardize(series):
+    series = series - series.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return series / series.std(axis=1, keepdims=True)
+
+
+# Correlation of every row of `a` with the same row of `b` shifted by each lag; a frame
+# indexed by `labels` with one column per lag (NaN for series that never change).
+def cross_correlation(a, b, labels, max_lag=24, batch=1024):
+    hours = a.shape[1]
+    size = 1 << (2 * hours - 1).bit_length()
+    lags = np.arange(-max_lag, max_lag + 1)
+    ccf = np.empty((len(a), len(lags)))
+    for start in range(0, len(a), batch):
+        rows = slice(start, start + batch)
+        spectrum = np.conj(np.fft.rfft(_standardize(a[rows].astype(np.float64)), size)) \
+            * np.fft.rfft(_standardize(b[rows].astype(np.float64)), size)
+        ccf[rows] = np.fft.irfft(spectrum, size)[:, lags % size] / hours
+    return pd.DataFrame(ccf, index=pd.Index(labels), columns=pd.Index(lags, name='lag (h)'))
+
+
+# the lag of the strongest correlation (either sign) of every series, and its strength
+def ccf_peaks(ccf):
+    values = ccf.to_numpy()
+    peak = np.nanargmax(np.where(np.isnan(values), -np.inf, np.abs(values)), axis=1)
+    strongest = values[np.arange(len(values)), peak]
+    return pd.DataFrame({'peak lag (h)': np.where(np.isnan(strongest), np.nan, ccf.columns.to_numpy()[peak]),
+                         'peak correlation': strongest,
+                         'correlation at lag 0': ccf[0].to_numpy()}, index=ccf.index)
+
+
+### Out-of-core mode
+# The same Analysis 1 borough totals and Analysis 4 locations table, computed without
+# ever holding a whole source in memory: every file is streamed in chunks sized to a
+# memory budget (from the memory per row of a sample read with the same dtypes, times
+# a margin for the working copies of a chunk). The borough totals are a handful of
+# running sums. Each chunk's cell counts are spilled to disk, split by cell hash into
+# `partitions` files, and the partitions are merged one at a time, so merging needs
+# memory for one partition's cells only. Coordinates are read and quantized exactly as
+# in the in-memory path, so the results are the same.
+
+SPILL_DIR = os.path.join(CACHE_DIR, 'spill')
+SIZE_UNITS = {'KB': 2**10, 'MB': 2**20, 'GB': 2**30, 'TB': 2**40}
+BOROUGH_ORDER = ['Staten Island', 'Bronx', 'Manhattan', 'Queens', 'Brooklyn']
+
+
+# bytes from an int or a string such as '512MB' or '2 GB'
+def parse_size(size):
+    if isinstance(size, str):
+        size = size.upper().replace(' ', '')
+        for unit, factor in SIZE_UNITS.items():
+            if size.endswith(unit):
+                return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def budget_chunksize(path, budget, sample=10_000, margin=4, **kwargs):
+    head = pd.read_csv(path, nrows=sample, **kwargs)
+    per_row = head.memory_usage(deep=True).sum() / max(len(head), 1)
+    return max(int(parse_size(budget) / (per_row * margin)), 1_000)
+
+
+# the Analysis 1 tables: rides per borough, in the report's order
+def borough_table(counts):
+    borough_data = pd.DataFrame()
+    borough_data['Borough'] = BOROUGH_ORDER
+    borough_data['Uber Rides'] = borough_data['Borough'].map(counts)
+    return borough_data
+
+
+# 2014 pickups per borough polygon, like value_counts() of the 'uber_2014_boroughs' labels
+def chunked_borough_counts(paths, boros, budget, name_col='boro_name'):
+    raster = borough_raster(boros)
+    totals = pd.Series(0, index=pd.Index(boros[name_col].to_numpy(), name='Borough'), name='count')
+    for path in paths:
+        chunksize = budget_chunksize(path, budget, dtype=UBER_2014_DTYPES)
+        for chunk in pd.read_csv(path, usecols=['Lat', 'Lon'], dtype=UBER_2014_DTYPES, chunksize=chunksize):
+            codes = label_boroughs(chunk, boros, raster=raster).codes
+            totals += np.bincount(codes[codes >= 0], minlength=len(totals))
+    return totals.sort_values(ascending=False)
+
+
+# 2015 pickups per taxi zone borough, like value_counts() of the zone-merged frame
+def chunked_zone_counts(path, zones, budget):
+    chunksize = budget_chunksize(path, budget, dtype=UBER_2015_DTYPES)
+    by_zone = pd.Series(0, index=zones['LocationID'].to_numpy(), dtype=np.int64)
+    for chunk in pd.read_csv(path, usecols=['locationID'], dtype=UBER_2015_DTYPES, chunksize=chunksize):
+        by_zone = by_zone.add(chunk['locationID'].value_counts(), fill_value=0).astype(np.int64)
+    totals = by_zone.reindex(zones['LocationID'].to_numpy()).groupby(zones['Borough'].to_numpy()).sum()
+    return totals.astype(np.int64).rename_axis('Borough').rename('count').sort_values(ascending=False)
+
+
+# sources maps a count column to an iterable of chunks with Lat/Lon; returns the
+# 'locations' table (3 decimal cells in cell id order)
+def chunked_locations(sources, path=SPILL_DIR, partitions=16, decimals=3, keys=('Lat', 'Lon')):
+    lat, lon = keys
+    names = list(sources)
+    os.makedirs(path, exist_ok=True)
+    for old in glob.glob(os.path.join(path, '*.feather')):
+        os.remove(old)
+
+    part = 0
+    for name, chunks in sources.items():
+        for chunk in chunks:
+            cells, counts = np.unique(cell_ids(chunk, decimals, keys)[0], return_counts=True)
+            partial = pd.DataFrame({'cell': cells, **{other: counts if other == name else 0 for other in names}})
+            for partition, rows in partial.groupby(partial['cell'] % partitions):
+                _write_feather(rows.reset_index(drop=True), os.path.join(path, f'{partition:03d}-{part:06d}.feather'))
+            part += 1
+
+    merged = []
+    for partition in range(partitions):
+        files = sorted(glob.glob(os.path.join(path, f'{partition:03d}-*.feather')))
+        if files:
+            merged.append(pd.concat([feather.read_feather(f) for f in files]).groupby('cell')[names].sum())
+            for f in files:
+                os.remove(f)
+    counts = pd.concat(merged).sort_index()
+    lat_index, lon_index = unpack_cells(counts.index.to_numpy())
+    return pd.DataFrame({lat: lat_index / 10**decimals, lon: lon_index / 10**decimals,
+                         **{name: counts[name].to_numpy(dtype=np.int64) for name in names}})
+
+
+def _read_chunks(path, budget, dtype, usecols=None, rename=None):
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=budget_chunksize(path, budget, dtype=dtype)):
+        yield chunk.rename(columns=rename) if rename else chunk
+
+
+# borough_data, borough_data_15 and locations within a memory budget (bytes or e.g. '1GB')
+def run_out_of_core(budget, spill=SPILL_DIR, partitions=16):
+    boros = gpd.read_file('Borough_Boundaries.geojson')
+    zones = load_taxi_zones('taxi_zone_lookup.csv')
+    crime_chunksize = budget_chunksize('NYPD_complaint_data.csv', budget)
+    sources = {'num_crime': (chunk.rename(columns={'Latitude': 'Lat', 'Longitude': 'Lon'})
+                             for chunk in crime_chunks('NYPD_complaint_data.csv', CRIME_COLUMNS, (2014, 2015), crime_chunksize)),
+               'num_lyft': _read_chunks('other-LYFT_B02510.csv', budget, LYFT_DTYPES, usecols=list(LYFT_DTYPES),
+                                        rename={'start_lat': 'Lat', 'start_lng': 'Lon'}),
+               'num_uber': (chunk for path in UBER_2014_FILES
+                            for chunk in _read_chunks(path, budget, UBER_2014_DTYPES, usecols=['Lat', 'Lon']))}
+    return {'borough_data': borough_table(chunked_borough_counts(UBER_2014_FILES, boros, budget)),
+            'borough_data_15': borough_table(chunked_zone_counts('uber-raw-data-janjune-15.csv', zones, budget)),
+            'locations': chunked_locations(sources, spill, partitions)}
+
+
+### Parallel loading
+# The source files are independent and parsing them is CPU-bound, so load_parallel()
+# parses them in a process pool, one file per worker, largest first. Only the sources
+# without a current cache entry are parsed, and the workers only fill the Feather
+# cache; the parent then loads every source from its cache entry (a memory-mapped
+# read) instead of having each parsed frame pickled back to it. With a
+# core per file, the wall-clock time is close to that of the slowest file (the NYPD
+# history). The borough GeoJSON is only five polygons and is read directly.
+
+UBER_2014_FILES = ['uber-raw-data-apr14.csv', 'uber-raw-data-may14.csv', 'uber-raw-data-jun14.csv',
+                   'uber-raw-data-jul14.csv', 'uber-raw-data-aug14.csv', 'uber-raw-data-sep14.csv']
+# name: (loader, cache spec function, path, *args); both functions take (path, *args)
+SOURCES = {**{os.path.splitext(path)[0]: (load_uber_2014, uber_2014_cache, path) for path in UBER_2014_FILES},
+           'uber-raw-data-janjune-15': (load_uber_2015, uber_2015_cache, 'uber-raw-data-janjune-15.csv'),
+           'lyft': (load_lyft, lyft_cache, 'other-LYFT_B02510.csv'),
+           'crime': (load_crime, crime_cache, 'NYPD_complaint_data.csv', CRIME_COLUMNS, (2014, 2015)),
+           'tlc_snapshot': (load_fhv_report, fhv_report_cache, 'FHV_Base_Aggregate_Report_20240926.csv'),
+           'tlc_report': (load_fhv_report, fhv_report_cache, 'FHV_Base_Aggregate_Report.csv')}
+
+
+def _fill_entry(loader, cache, *args):
+    loader(*args)
+
+
+# jobs maps a name to (loader, cache, path, *args), like SOURCES; afterwards every job has a cache entry
+def fill_cache(jobs=None, workers=None):
+    jobs = SOURCES if jobs is None else jobs
+    missing = [name for name, (loader, cache, *args) in jobs.items() if not os.path.exists(cache_path(*cache(*args)))]
+    order = sorted(missing, key=lambda name: os.path.getsize(jobs[name][2]), reverse=True)
+    if len(order) == 1:
+        _fill_entry(*jobs[order[0]])
+    elif order:
+        with ProcessPoolExecutor(max_workers=workers or min(len(order), os.cpu_count())) as pool:
+            for future in [pool.submit(_fill_entry, *jobs[name]) for name in order]:
+                future.result()
+
+
+# returns {name: frame} in the order of jobs
+def load_parallel(jobs=None, workers=None):
+    jobs = SOURCES if jobs is None else jobs
+    fill_cache(jobs, workers)
+    return {name: loader(*args) for name, (loader, cache, *args) in jobs.items()}
+
+
+### Sharded aggregation
+# The locations table and the Analysis 1 borough totals as a map-reduce over a process
+# pool. Every source's cache entry is split into shards of `shard_rows` rows (so one
+# big file, like the NYPD history, is spread over several workers as well), and each
+# worker memory-maps just its shard's coordinate columns and returns its 3 decimal
+# cells with their counts, plus its borough or taxi zone tally. The partials are
+# reduced in shard order with integer sums, so the result does not depend on the
+# number of workers or on which worker finished first, and equals the in-memory one.
+
+# count column or tally: (SOURCES name, cache entry, columns read)
+SHARD_SOURCES = [*(('num_uber', os.path.splitext(path)[0], path, ['Lat', 'Lon']) for path in UBER_2014_FILES),
+                 ('num_lyft', 'lyft', 'other-LYFT_B02510.csv', ['start_lat', 'start_lng']),
+                 ('num_crime', 'crime', 'crime-NYPD_complaint_data.csv', ['Latitude', 'Longitude']),
+                 ('zones', 'uber-raw-data-janjune-15', 'uber-raw-data-janjune-15.csv', ['locationID'])]
+_shard_boroughs = None
+
+
+def _init_shard_worker(boros, raster):
+    global _shard_boroughs
+    _shard_boroughs = boros, raster
+
+
+def _count_shard(kind, path, columns, start, stop, decimals):
+    data = feather.read_table(path, columns=columns, memory_map=True).slice(start, stop - start).to_pandas()
+    if kind == 'zones':
+        return None, None, data['locationID'].value_counts()
+    lat, lon = columns
+    cells, counts = np.unique(cell_ids(data, decimals, columns)[0], return_counts=True)
+    tally = None
+    if kind == 'num_uber':
+        boros, raster = _shard_boroughs
+        codes = label_boroughs(data, boros, lat=lat, lon=lon, raster=raster).codes
+        tally = np.bincount(codes[codes >= 0], minlength=len(boros))
+    return cells, counts, tally
+
+
+# borough_data, borough_data_15 and locations from `workers` processes (all cores by default)
+def run_sharded(workers=None, shard_rows=1_000_000, decimals=3, keys=('Lat', 'Lon')):
+    fill_cache({name: SOURCES[name] for _, name, _, _ in SHARD_SOURCES}, workers)
+    boros = gpd.read_file('Borough_Boundaries.geojson')
+    raster = borough_raster(boros)
+
+    tasks = []
+    for kind, _, entry, columns in SHARD_SOURCES:
+        path = cache_entry(entry)
+        rows = feather.read_table(path, columns=columns[:1], memory_map=True).num_rows
+        tasks += [(kind, path, columns, start, min(start + shard_rows, rows), decimals) for start in range(0, rows, shard_rows)]
+
+    if workers == 1 or (workers is None and os.cpu_count() == 1):
+        _init_shard_worker(boros, raster)
+        results = [_count_shard(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker, initargs=(boros, raster)) as pool:
+            results = list(pool.map(_count_shard, *zip(*tasks)))
+
+    names = ['num_crime', 'num_lyft', 'num_uber']
+    partial = {name: [(cells, counts) for (kind, *_), (cells, counts, _) in zip(tasks, results) if kind == name] for name in names}
+    cells = np.unique(np.concatenate([part for name in names for part, _ in partial[name]]))
+    columns = {}
+    for name in names:
+        position = np.concatenate([np.searchsorted(cells, part) for part, _ in partial[name]])
+        columns[name] = np.bincount(position, weights=np.concatenate([counts for _, counts in partial[name]]),
+                                    minlength=len(cells)).astype(np.int64)
+    lat_index, lon_index = unpack_cells(cells)
+    lat, lon = keys
+    locations = pd.DataFrame({lat: lat_index / 10**decimals, lon: lon_index / 10**decimals, **columns})
+
+    boroughs = sum(tally for (kind, *_), (_, _, tally) in zip(tasks, results) if kind == 'num_uber')
+    borough_counts = pd.Series(boroughs, index=pd.Index(boros['boro_name'].to_numpy(), name='Borough'), name='count')
+    zones = load_taxi_zones('taxi_zone_lookup.csv')
+    by_zone = pd.concat([tally for (kind, *_), (_, _, tally) in zip(tasks, results) if kind == 'zones']).groupby(level=0).sum()
+    zone_counts = by_zone.reindex(zones['LocationID'].to_numpy(), fill_value=0).groupby(zones['Borough'].to_numpy()).sum()
+    return {'borough_data': borough_table(borough_counts.sort_values(ascending=False)),
+            'borough_data_15': borough_table(zone_counts.astype(np.int64).rename_axis('Borough').rename('count')),
+            'locations': locations}
+
+
+### Pipeline stages
+# The notebook's loading, merging, cleaning, labeling and counting steps as named
+# stages. Each stage declares the stages and source files it reads, and its output is
+# memoized on disk (cache/stages) under a key hashed from its code (including the
+# helpers it calls, also from nested functions and lambdas, and the module constants
+# any of them read), its source files' size and modification time, and the keys of its
+# input stages. run_stage() only re-runs stages whose key changed and loads the rest,
+# so editing one step re-runs that step and what depends on it, and a single analysis
+# can be run on its own (run_analysis, or `python nyc_rideshare.py 4`). Stage outputs
+# are shared within a session, so copy them before modifying them in place.
+
+STAGES = {}
+STAGE_DIR = os.path.join(CACHE_DIR, 'stages')
+_stage_outputs = {}
+
+
+def stage(name, inputs=(), files=()):
+    def register(func):
+        STAGES[name] = {'func': func, 'inputs': list(inputs), 'files': list(files)}
+        return func
+    return register
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+# repr of a module constant, with the code of any of this module's functions in it
+# (e.g. the loaders in SOURCES) instead of their memory addresses
+def _constant_source(value, seen):
+    if inspect.isfunction(value):
+        return code_source(value, seen) if value.__module__ == __name__ and value.__name__ not in seen else value.__qualname__
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{_constant_source(k, seen)}: {_constant_source(v, seen)}' for k, v in value.items()) + '}'
+    if isinstance(value, (set, frozenset)):
+        return type(value).__name__ + '(' + ', '.join(sorted(_constant_source(v, seen) for v in value)) + ')'
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + '(' + ', '.join(_constant_source(v, seen) for v in value) + ')'
+    return repr(value)
+
+
+def code_source(func, seen=None):
+    seen = set() if seen is None else seen
+    seen.add(func.__name__)
+    source = inspect.getsource(func)
+    # default arguments are evaluated when the function is defined, so hash their values
+    source += f'\n{func.__name__} defaults: {_constant_source(func.__defaults__, seen)} {_constant_source(func.__kwdefaults__, seen)}\n'
+    for name in sorted(_code_names(func.__code__)):
+        if name in seen or name not in globals():
+            continue
+        value = globals()[name]
+        if inspect.isfunction(value):
+            if value.__module__ == __name__:
+                source += code_source(value, seen)
+        elif not (name.startswith('_') or inspect.ismodule(value) or inspect.isclass(value) or callable(value)):
+            seen.add(name)
+            source += f'\n{name} = {_constant_source(value, seen)}\n'
+    return source
+
+
+# a key for data derived from the given stages
+def data_key(*names):
+    return hashlib.sha1('|'.join(stage_key(name) for name in names).encode()).hexdigest()[:16]
+
+
+def stage_key(name):
+    spec = STAGES[name]
+    key = hashlib.sha1(code_source(spec['func']).encode())
+    key.update(cache_key(spec['files']).encode())
+    for dependency in spec['inputs']:
+        key.update(stage_key(dependency).encode())
+    return key.hexdigest()[:16]
+
+
+def run_stage(name, rerun=False):
+    key = stage_key(name)
+    if not rerun and name in _stage_outputs and _stage_outputs[name][0] == key:
+        return _stage_outputs[name][1]
+
+    path = os.path.join(STAGE_DIR, f'{name}-{key}.pkl')
+    if not rerun and os.path.exists(path):
+        with open(path, 'rb') as f:
+            output = pickle.load(f)
+    else:
+        spec = STAGES[name]
+        output = spec['func'](*(run_stage(dependency) for dependency in spec['inputs']))
+        os.makedirs(STAGE_DIR, exist_ok=True)
+        for stale in glob.glob(os.path.join(STAGE_DIR, glob.escape(name) + '-*.pkl')):
+            os.remove(stale)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    _stage_outputs[name] = (key, output)
+    return output
+
+
+# Which stages are memoized on disk with their current key, and which would re-run.
+def stage_status():
+    rows = []
+    for name, spec in STAGES.items():
+        try:
+            key = stage_key(name)
+        except FileNotFoundError:
+            key = None
+        rows.append({'stage': name, 'inputs': ', '.join(spec['inputs'] + spec['files']),
+                     'up to date': key is not None and os.path.exists(os.path.join(STAGE_DIR, f'{name}-{key}.pkl'))})
+    return pd.DataFrame(rows).set_index('stage')
+
+
+### Dataset registry
+# The notebook used to .copy() a frame before changing it, so the monthly Uber frames,
+# the combined 2014 frame and the crime frame were each held several times over.
+# dataset() instead hands out copy-on-write handles of the one canonical frame each
+# stage produces: a handle shares the canonical frame's memory, and only the columns a
+# cell modifies are copied (into the handle, never into the canonical frame). The
+# registry tracks the live handles of every stage; release() drops canonical frames
+# that no handle refers to any more, and run_analysis() releases the intermediate
+# stages it does not return, so their memory is given back once they are used.
+# Copy-on-write is always on from pandas 3; before that it is the caller's choice
+# (the notebook turns it on), and with it off dataset() hands out full copies instead.
+
+
+# whether shallow copies are safe to hand out
+def _copy_on_write():
+    return int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+
+_handles = {}
+
+
+def dataset(name):
+    data = run_stage(name)
+    if not isinstance(data, (pd.DataFrame, pd.Series)):
+        return data
+    handle = data.copy(deep=not _copy_on_write())
+    _handles.setdefault(name, weakref.WeakValueDictionary())[id(handle)] = handle
+    return handle
+
+
+# Drops the canonical output of every named stage (default: all) that has no live handle.
+def release(names=None):
+    gc.collect()
+    names = list(_stage_outputs) if names is None else names
+    freed = [name for name in names if name in _stage_outputs and not _handles.get(name)]
+    for name in freed:
+        del _stage_outputs[name]
+    gc.collect()
+    return freed
+
+
+# Canonical frames currently held, with their size and how many handles refer to them.
+def live_datasets():
+    gc.collect()
+    rows = [{'stage': name,
+             'MB': output.memory_usage(deep=True).sum() / 2**20 if isinstance(output, pd.DataFrame) else np.nan,
+             'handles': len(_handles.get(name, ()))}
+            for name, (key, output) in _stage_outputs.items()]
+    return pd.DataFrame(rows, columns=['stage', 'MB', 'handles']).set_index('stage')
+
+
+# Highest resident memory of this process so far, in MB (ru_maxrss is KB on Linux, bytes on macOS).
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+@stage('tlc_snapshot', inputs=['base_companies'], files=['FHV_Base_Aggregate_Report_20240926.csv'])
+def stage_tlc_snapshot(base_companies):
+    report = load_fhv_report('FHV_Base_Aggregate_Report_20240926.csv')
+    return report.assign(Company=base_company(report['Base License Number'], base_companies))
+
+
+@stage('tlc_report', inputs=['base_companies'], files=['FHV_Base_Aggregate_Report.csv'])
+def stage_tlc_report(base_companies):
+    report = load_fhv_report('FHV_Base_Aggregate_Report.csv')
+    return report.assign(Company=base_company(report['Base License Number'], base_companies))
+
+
+# what changed between the report used in Analysis 2 and the 2024-09-26 snapshot
+@stage('tlc_diff', files=['FHV_Base_Aggregate_Report.csv', 'FHV_Base_Aggregate_Report_20240926.csv'])
+def stage_tlc_diff():
+    return diff_fhv_snapshots('FHV_Base_Aggregate_Report.csv', 'FHV_Base_Aggregate_Report_20240926.csv')
+
+
+# every base in either snapshot of the report, plus the trip data's dispatch bases
+@stage('base_companies', inputs=['tlc_diff'])
+def stage_base_companies(tlc_diff):
+    return base_companies(tlc_diff['merged'])
+
+
+@stage('uber_2014', files=UBER_2014_FILES)
+def stage_uber_2014():
+    return concat_typed(load_parallel({path: (load_uber_2014, uber_2014_cache, path) for path in UBER_2014_FILES}).values())
+
+
+@stage('uber_2015', files=['uber-raw-data-janjune-15.csv'])
+def stage_uber_2015():
+    return load_uber_2015('uber-raw-data-janjune-15.csv')
+
+
+# the 2014 and 2015 pickups in one frame, with one pickup time, one dispatch base and its company
+@stage('kaggle', inputs=['uber_2014', 'uber_2015', 'base_companies'])
+def stage_kaggle(uber_2014, uber_2015, base_companies):
+    kaggle = pd.concat([uber_2014, uber_2015], axis=0, ignore_index=True)
+    kaggle['Complete Pickup Time'] = pd.concat([parse_timestamps(uber_2014['Date/Time'], UBER_2014_TIME_FORMAT),
+                                                parse_timestamps(uber_2015['Pickup_date'], UBER_2015_TIME_FORMAT)],
+                                               axis=0, ignore_index=True)
+    kaggle['Dispatch Base'] = concat_typed([uber_2014['Base'], uber_2015['Dispatching_base_num']], axis=0, ignore_index=True)
+    kaggle['Company'] = base_company(kaggle['Dispatch Base'], base_companies)
+    return kaggle.drop(columns=['Date/Time', 'Base', 'Dispatching_base_num', 'Pickup_date', 'Affiliated_base_num'])
+
+
+@stage('crime', files=['NYPD_complaint_data.csv'])
+def stage_crime():
+    return load_crime('NYPD_complaint_data.csv', names=CRIME_COLUMNS, years=(2014, 2015))
+
+
+@stage('boroughs', files=['Borough_Boundaries.geojson'])
+def stage_boroughs():
+    return gpd.read_file('Borough_Boundaries.geojson')
+
+
+@stage('uber_2014_boroughs', inputs=['uber_2014', 'boroughs'])
+def stage_uber_2014_boroughs(uber_2014, boroughs):
+    return label_boroughs(uber_2014, boroughs)
+
+
+@stage('lyft', files=['other-LYFT_B02510.csv'])
+def stage_lyft():
+    return load_lyft('other-LYFT_B02510.csv').rename(columns={'start_lat': 'Lat', 'start_lng': 'Lon'})
+
+
+# the number of crimes, Lyfts and Ubers in every cell at 2, 3 and 4 decimals
+@stage('cell_counts', inputs=['crime', 'lyft', 'uber_2014'])
+def stage_cell_counts(crime, lyft, uber_2014):
+    crime = crime.rename(columns={'Latitude': 'Lat', 'Longitude': 'Lon'})
+    return multires_counts({'num_crime': crime, 'num_lyft': lyft, 'num_uber': uber_2014})
+
+
+# every (Lat, Lon) cell at 3 decimals with anything in it, and its counts
+@stage('locations', inputs=['cell_counts'])
+def stage_locations(cell_counts):
+    return cell_counts[3].reset_index(drop=True)
+
+
+# the borough of every location, from the saved cell borough index (see cell_boroughs)
+@stage('location_boroughs', inputs=['locations', 'crime', 'boroughs'])
+def stage_location_boroughs(locations, crime, boroughs):
+    crime = round_cells(crime.rename(columns={'Latitude': 'Lat', 'Longitude': 'Lon'}), 3)
+    return cell_boroughs(locations, crime, boroughs, decimals=3, path=CELL_BOROUGH_INDEX, key=data_key('crime', 'boroughs'))
+
+
+# Uber and Lyft pickups against crimes per cell: overall, per borough (Pearson and
+# Spearman), at each resolution of cell_counts, and per month of the 2014 pickups.
+@stage('correlations', inputs=['locations', 'location_boroughs', 'cell_counts', 'crime', 'lyft', 'uber_2014'])
+def stage_correlations(locations, location_boroughs, cell_counts, crime, lyft, uber_2014):
+    counts = ['num_crime', 'num_lyft', 'num_uber']
+    locations = locations.assign(Borough=location_boroughs)
+    by_borough = corr_stats(locations, counts, by='Borough')
+    ranked = corr_stats(rank_within(locations, counts, by='Borough'), counts, by='Borough')
+
+    by_level = {decimals: corr_stats(level, counts) for decimals, level in cell_counts.items()}
+    crime = crime.rename(columns={'Latitude': 'Lat', 'Longitude': 'Lon'})
+    crime_2014 = crime[crime['complaint_year'] == 2014]
+    months = {'num_crime': (crime_2014, crime_2014['complaint_month']),
+              'num_lyft': (lyft, parse_timestamps(lyft['time_of_trip'], LYFT_TIME_FORMAT, errors='coerce').dt.month),
+              'num_uber': (uber_2014, parse_timestamps(uber_2014['Date/Time'], UBER_2014_TIME_FORMAT).dt.month)}
+    by_month = {}
+    for month in range(4, 10):
+        month_counts = multires_counts({name: data[(month_of == month).to_numpy()] for name, (data, month_of) in months.items()},
+                                       levels=(3,))[3]
+        by_month[month] = corr_stats(month_counts, counts)
+
+    def table(stats):
+        stats = pd.concat(stats).droplevel(-1)
+        return pd.DataFrame({'uber': pearson(stats, 'num_uber', 'num_crime'), 'lyft': pearson(stats, 'num_lyft', 'num_crime')})
+
+    return {'with crime': corr_with(by_borough, counts, 'num_crime').sort_values(ascending=False),
+            'uber by borough': pearson(by_borough, 'num_uber', 'num_crime').sort_values(ascending=False),
+            'lyft by borough': pearson(by_borough, 'num_lyft', 'num_crime').sort_values(ascending=False),
+            'spearman by borough': pd.DataFrame({'uber': pearson(ranked, 'num_uber', 'num_crime'),
+                                                 'lyft': pearson(ranked, 'num_lyft', 'num_crime')}),
+            'by resolution': table(by_level).rename_axis('decimals'),
+            'by month': table(by_month).rename_axis('month (2014)'),
+            'stats': by_borough}
+
+
+# pickups and complaints by source, year, month, day, day of week, hour and borough;
+# the 2015 pickups take the borough of their taxi zone
+@stage('time_cube', inputs=['kaggle', 'uber_2014_boroughs', 'lyft', 'crime', 'boroughs'], files=['taxi_zone_lookup.csv'])
+def stage_time_cube(kaggle, uber_2014_boroughs, lyft, crime, boroughs):
+    pickups_2014 = kaggle.iloc[:len(uber_2014_boroughs)]
+    pickups_2015 = kaggle.iloc[len(uber_2014_boroughs):]
+    zones = load_taxi_zones('taxi_zone_lookup.csv').set_index('LocationID')['Borough']
+    complaint_hours = parse_timestamps(crime['complaint_time'], CRIME_TIME_FORMAT, errors='coerce').dt.hour
+    return time_cube([('uber', pickups_2014['Complete Pickup Time'], uber_2014_boroughs),
+                      ('uber', pickups_2015['Complete Pickup Time'], zones.reindex(pickups_2015['locationID'].astype('int16')).array),
+                      ('lyft', parse_timestamps(lyft['time_of_trip'], LYFT_TIME_FORMAT, errors='coerce'),
+                       label_boroughs(lyft, boroughs)),
+                      ('crime', crime['complaint_date'], crime['borough'], complaint_hours.fillna(-1))])
+
+
+# bootstrap intervals and spatial-block permutation p-values of the Uber and Lyft
+# correlations with crime, over all cells and per borough
+@stage('significance', inputs=['locations', 'location_boroughs'])
+def stage_significance(locations, location_boroughs):
+    locations = locations.assign(Borough=location_boroughs)
+    return resample_correlations(locations, ['num_uber', 'num_lyft'], 'num_crime', by='Borough',
+                                 blocks=spatial_blocks(locations, 2))
+
+
+# the crimes within 100 m and 250 m of every Lyft and 2014 Uber pickup
+@stage('crime_radius', inputs=['crime', 'lyft', 'uber_2014'])
+def stage_crime_radius(crime, lyft, uber_2014):
+    tree = point_tree(crime, keys=('Latitude', 'Longitude'))
+    return {'uber': radius_counts(tree, uber_2014, [100, 250]), 'lyft': radius_counts(tree, lyft, [100, 250])}
+
+
+# the complaints within 250 m and an hour of every Uber (2014-2015) and Lyft pickup
+@stage('spacetime_crime', inputs=['kaggle', 'lyft', 'crime'])
+def stage_spacetime_crime(kaggle, lyft, crime):
+    complaints = (crime_times(crime), crime['Latitude'], crime['Longitude'])
+    column = 'complaints within 250 m, 1 h'
+    return {'uber': pd.Series(spacetime_counts((kaggle['Complete Pickup Time'], kaggle['Lat'], kaggle['Lon']), complaints),
+                              index=kaggle.index, name=column),
+            'lyft': pd.Series(spacetime_counts((parse_timestamps(lyft['time_of_trip'], LYFT_TIME_FORMAT, errors='coerce'),
+                                                lyft['Lat'], lyft['Lon']), complaints), index=lyft.index, name=column)}
+
+
+# hourly pickups against hourly complaints over the months of each pickup source, per
+# borough and per 2 decimal cell (cells with both pickups and complaints)
+@stage('lagged_correlations', inputs=['uber_2014', 'uber_2014_boroughs', 'lyft', 'crime', 'boroughs'])
+def stage_lagged_correlations(uber_2014, uber_2014_boroughs, lyft, crime, boroughs):
+    complaint_times = crime_times(crime)
+    complaint_cells, located = cell_ids(crime, 2, ('Latitude', 'Longitude'))
+    complaint_boroughs = np.asarray(BOROUGHS + [None], dtype=object)[_label_codes(crime['borough'], BOROUGHS)]
+    pickups = {'uber': (parse_timestamps(uber_2014['Date/Time'], UBER_2014_TIME_FORMAT), uber_2014, uber_2014_boroughs),
+               'lyft': (parse_timestamps(lyft['time_of_trip'], LYFT_TIME_FORMAT, errors='coerce'), lyft, label_boroughs(lyft, boroughs))}
+
+    results, by_borough, by_cell = {}, {}, {}
+    for source, (times, data, data_boroughs) in pickups.items():
+        start, end = times.min().floor('D'), times.max().ceil('D')
+        hours = int((end - start) / pd.Timedelta(hours=1))
+        pickup_boroughs = np.asarray(BOROUGHS + [None], dtype=object)[_label_codes(data_boroughs, BOROUGHS)]
+        ccf = cross_correlation(hourly_counts(times, pickup_boroughs, BOROUGHS, start, hours),
+                                hourly_counts(complaint_times, complaint_boroughs, BOROUGHS, start, hours), BOROUGHS)
+        results[f'{source} by borough'] = ccf
+        by_borough[source] = ccf_peaks(ccf)
+
+        pickup_cells, known = cell_ids(data, 2)
+        cells = np.intersect1d(pickup_cells, complaint_cells)
+        cell_ccf = cross_correlation(hourly_counts(times[known], pickup_cells, cells, start, hours),
+                                     hourly_counts(complaint_times[located], complaint_cells, cells, start, hours), cells)
+        lat, lon = unpack_cells(cells)
+        by_cell[source] = ccf_peaks(cell_ccf).assign(Lat=lat / 100, Lon=lon / 100)
+
+    results['peaks by borough'] = pd.concat(by_borough, names=['source', 'borough'])
+    results['peaks by cell'] = pd.concat(by_cell, names=['source', 'cell'])
+    return results
+
+
+ANALYSES = {1: ['uber_2014_boroughs', 'uber_2015'],
+            2: ['tlc_report', 'kaggle', 'crime', 'time_cube', 'lagged_correlations'],
+            3: ['crime', 'boroughs', 'time_cube'],
+            4: ['locations', 'location_boroughs', 'correlations', 'significance', 'crime_radius', 'spacetime_crime']}
+
+
+# every source file a stage reads, directly or through its input stages
+def stage_files(name):
+    spec = STAGES[name]
+    return set(spec['files']).union(*(stage_files(dependency) for dependency in spec['inputs']))
+
+
+# parses the analysis's source files in parallel first, so its stages load them from the cache
+def run_analysis(number):
+    files = set().union(*(stage_files(name) for name in ANALYSES[number]))
+    fill_cache({name: job for name, job in SOURCES.items() if job[2] in files})
+    outputs = {name: dataset(name) for name in ANALYSES[number]}
+    release([name for name in _stage_outputs if name not in ANALYSES[number]])
+    return outputs
+
+
+if __name__ == '__main__':
+    targets = sys.argv[1:]
+    if targets[:1] == ['--memory-budget']:
+        for name, result in run_out_of_core(targets[1]).items():
+            print(name, result, sep='\n')
+        targets = targets[2:]
+    if targets[:1] == ['--workers']:
+        for name, result in run_sharded(int(targets[1])).items():
+            print(name, result, sep='\n')
+        targets = targets[2:]
+    for target in targets:
+        if target.isdigit():
+            run_analysis(int(target))
+        else:
+            run_stage(target)
+    print(stage_status())
+    print(f'peak RSS: {peak_rss():,.0f} MB')
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import nyc_rideshare as nyc
+
+
+def _haversine_counts(points, events, radius):
+    distances = nyc._haversine(points[:, None, 0], points[:, None, 1], events[None, :, 0], events[None, :, 1])
+    return (distances <= radius).sum(axis=1)
+
+
+def test_count_within_matches_brute_force_haversine():
+    rng = np.random.default_rng(0)
+    crimes = np.column_stack([rng.normal(40.74, 0.01, 5_000), rng.normal(-73.98, 0.01, 5_000)])
+    # 4 decimal pickups, as in the Uber files, with repeats
+    pickups = pd.DataFrame({'Lat': np.round(rng.normal(40.74, 0.01, 2_000), 4).astype('float32'),
+                            'Lon': np.round(rng.normal(-73.98, 0.01, 2_000), 4).astype('float32')})
+    pickups = pd.concat([pickups, pickups.iloc[:500]], ignore_index=True)
+    pickups.loc[3, 'Lat'] = np.nan
+
+    tree = nyc.point_tree(pd.DataFrame(crimes, columns=['Lat', 'Lon']))
+    counts = nyc.count_within(tree, pickups, 250, batch=300)
+
+    known = pickups['Lat'].notna().to_numpy()
+    expected = _haversine_counts(pickups[known].to_numpy(dtype=np.float64), crimes, 250)
+    assert (counts[known] == expected).all()
+    assert counts[3] == 0
+
+
+def test_cell_index_matches_round_on_ties():
+    rng = np.random.default_rng(2)
+    # 4 decimal coordinates, half of them ties at 3 decimals
+    values = np.round(np.concatenate([rng.uniform(40.5, 40.9, 5_000), rng.uniform(-74.2, -73.7, 5_000)]), 4)
+    for decimals in (2, 3, 4):
+        expected = [round(value, decimals) for value in values.tolist()]
+        for dtype in (np.float64, np.float32):
+            assert (nyc.cell_index(values.astype(dtype), decimals) / 10**decimals == np.round(expected, decimals)).all()
+    assert nyc.cell_index(np.array([40.72149, 40.7214, -73.9816]), 3).tolist() == [40721, 40721, -73982]
+
+
+def test_multires_counts_roll_up_to_round_cells():
+    rng = np.random.default_rng(1)
+    points = pd.DataFrame({'Lat': np.round(rng.normal(40.74, 0.02, 20_000), 4).astype('float32'),
+                           'Lon': np.round(rng.normal(-73.98, 0.02, 20_000), 4).astype('float32')})
+    points.loc[:9, 'Lat'] = np.nan
+    points.loc[5:14, 'Lon'] = np.nan
+    counts = nyc.multires_counts({'n': points})
+    for decimals, level in counts.items():
+        rounded = nyc.round_cells(points, decimals)
+        assert rounded['Lat'].isna().sum() == 10 and rounded['Lon'].isna().sum() == 10
+        expected = nyc.cell_counts({'n': rounded})['n']
+        assert level['n'].sum() == len(points) - 15
+        assert level.set_index(['Lat', 'Lon'])['n'].sort_index().equals(expected.sort_index())
+
+
+def test_parse_crime_dates_other_layouts_and_unparseable():
+    values = pd.Series(['04/01/2014', '2014-04-02', '04/03/2014 12:00:00 AM', None], dtype='category')
+    assert nyc.parse_crime_dates(values).tolist()[:3] == [pd.Timestamp(f'2014-04-0{day}') for day in (1, 2, 3)]
+    with pytest.raises(ValueError):
+        nyc.parse_crime_dates(pd.Series(['not a date', 'nor this'], dtype='category'))
+
+
+
+def test_time_cube_counts_match_value_counts_with_missing_times():
+    rng = np.random.default_rng(3)
+    times = pd.Series(pd.Timestamp('2014-01-01') + pd.to_timedelta(rng.integers(0, 2 * 365 * 86400, 3_000), unit='s'))
+    times[::7] = pd.NaT
+    boroughs = pd.Series(rng.choice(nyc.BOROUGHS + ['N/A'], 3_000))
+    hours = times.dt.hour.fillna(-1).astype('int64')
+    hours[::5] = -1
+    cube = nyc.time_cube([('lyft', times, boroughs), ('crime', times.dt.normalize(), boroughs, hours)])
+
+    known = times.notna()
+    records = pd.DataFrame({'hour': times.dt.hour, 'month': times.dt.month, 'dayofweek': times.dt.dayofweek,
+                            'borough': boroughs.where(boroughs.isin(nyc.BOROUGHS))})[known]
+    for by in ['hour', 'month', 'dayofweek', 'borough']:
+        assert nyc.cube_counts(cube, by, source='lyft').to_dict() == records[by].value_counts().to_dict()
+    assert nyc.cube_counts(cube, 'hour', source='crime').to_dict() == hours[known & (hours >= 0)].value_counts().to_dict()
+
+
+def test_ingesting_snapshot_changes_updates_rollup(tmp_path):
+    columns = ['Base License Number', 'Base Name', 'DBA', 'Year', 'Month', 'Month Name', 'Total Dispatched Trips',
+               'Total Dispatched Shared Trips', 'Unique Dispatched Vehicles']
+    old = pd.DataFrame([['B1', 'UBER', '', 2020, 1, 'January', 100, 0, 5],
+                        ['B2', 'LYFT', '', 2020, 1, 'January', 50, 0, 3],
+                        ['B3', 'CAR SERVICE', '', 2020, 1, 'January', 10, 0, 1]], columns=columns)
+    new = pd.concat([old.iloc[:2], pd.DataFrame([['B3', 'CAR SERVICE', '', 2020, 2, 'February', 20, 0, 1]],
+                                                columns=columns)], ignore_index=True)
+    new.loc[0, 'Total Dispatched Trips'] = 120
+    old.to_csv(tmp_path / 'old.csv', index=False)
+    new.to_csv(tmp_path / 'new.csv', index=False)
+
+    diff = nyc.diff_fhv_snapshots(tmp_path / 'old.csv', tmp_path / 'new.csv')
+    store = str(tmp_path / 'store')
+    report = pd.read_csv(tmp_path / 'old.csv', dtype=nyc.FHV_DTYPES)
+    nyc.ingest_fhv(report.assign(Company=nyc.base_company(report['Base License Number'], nyc.base_companies(diff['merged']))), store)
+    rollup = nyc.ingest_fhv(diff['changes'], store).set_index(['Year', 'Company'])
+
+    assert rollup.loc[(2020, 'UBER')].tolist() == [120, 1]
+    assert rollup.loc[(2020, 'LYFT')].tolist() == [50, 1]
+    assert rollup.loc[(2020, 'OTHER')].tolist() == [30, 2]
+    assert nyc.fhv_rollup(store).equals(nyc.ingest_fhv(diff['merged'].drop(columns='status'), str(tmp_path / 'fresh')))